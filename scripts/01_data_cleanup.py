@@ -1,11 +1,13 @@
 import os
 import json
+import heapq
 import datetime
+import tempfile
 from tqdm import tqdm
 from argparse import ArgumentParser
 
 # import the dataset loader
-from src.data.dataset import load_dataset
+from src.data.dataset import iter_dataset
 
 # ================================================
 # Static variables
@@ -28,6 +30,45 @@ class NewsArticleEncoder(json.JSONEncoder):
             return super().default(z)
 
 
+# the shared encoder instance (uses the C encoder for the whole article)
+encoder = NewsArticleEncoder(ensure_ascii=False)
+
+
+def get_sort_key(article):
+    """Gets the key used to sort the articles"""
+    return article["dateTime"]
+
+
+def write_articles(articles, file):
+    """Writes the articles as JSON lines"""
+    for article in articles:
+        file.write(encoder.encode(article))
+        file.write("\n")
+
+
+def spill_run(articles, run_path):
+    """Sorts the articles and writes them into the run file
+
+    Each line contains the sort key and the serialized article
+    separated by a tab.
+    """
+    articles.sort(key=get_sort_key)
+    with open(run_path, mode="w", encoding="utf8") as file:
+        for article in articles:
+            file.write(f"{get_sort_key(article).isoformat()}\t")
+            file.write(encoder.encode(article))
+            file.write("\n")
+    return run_path
+
+
+def read_run(run_path):
+    """Yields the sort keys and serialized articles of the run file"""
+    with open(run_path, mode="r", encoding="utf8") as file:
+        for line in file:
+            key, article = line.rstrip("\n").split("\t", 1)
+            yield key, article
+
+
 DATA_PATH = os.path.join(DIRNAME, "..", "data", "processed")
 # create the processed directory if not exists
 if not os.path.isdir(DATA_PATH):
@@ -40,23 +81,41 @@ if not os.path.isdir(DATA_PATH):
 
 
 def main(args):
-    # load the raw articles
-    dataset = load_dataset(args.raw_dir, dataType="raw")
-    # filter out the duplicates
-    dataset = list(filter(lambda x: not x["isDuplicate"], dataset))
-
-    print("Dataset loaded".ljust(50, ".") + "done!")
-
-    print("Sort dataset".ljust(50, "."), end="", flush=True)
-    # sort news articles in cronological order
-    dataset.sort(key=lambda x: x["dateTime"])
-    print("done!")
-
-    # store the articles in the articles file
-    with open(args.results, mode="w", encoding="utf8") as file:
-        for article in tqdm(dataset, desc="Saving progress"):
-            json.dump(article, file, ensure_ascii=False, cls=NewsArticleEncoder)
-            file.write("\n")
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        # load the raw articles and filter out the duplicates
+        runs, run = [], []
+        articles = iter_dataset(args.raw_dir, dataType="raw", workers=args.workers)
+        for article in articles:
+            if article["isDuplicate"]:
+                continue
+            run.append(article)
+            if len(run) == args.run_size:
+                # spill the sorted run to disk
+                run_path = os.path.join(tmp_dir, f"run-{len(runs):05d}.tsv")
+                runs.append(spill_run(run, run_path))
+                run = []
+
+        print("Dataset loaded".ljust(50, ".") + "done!")
+
+        print("Sort dataset".ljust(50, "."), end="", flush=True)
+        # sort news articles in cronological order
+        if len(runs) > 0 and len(run) > 0:
+            run_path = os.path.join(tmp_dir, f"run-{len(runs):05d}.tsv")
+            runs.append(spill_run(run, run_path))
+        else:
+            run.sort(key=get_sort_key)
+        print("done!")
+
+        # store the articles in the articles file
+        with open(args.results, mode="w", encoding="utf8") as file:
+            if len(runs) == 0:
+                write_articles(tqdm(run, desc="Saving progress"), file)
+            else:
+                # merge the sorted runs (ties keep the run order)
+                merged = heapq.merge(*[read_run(p) for p in runs], key=lambda x: x[0])
+                for _, article in tqdm(merged, desc="Saving progress"):
+                    file.write(article)
+                    file.write("\n")
 
     print("Dataset written to JSON".ljust(50, ".") + "done!")
 
@@ -65,5 +124,8 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--raw_dir", type=str)
     parser.add_argument("--results", type=str)
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--run_size", default=500000, type=int)
+    parser.add_argument("--tmp_dir", default=None, type=str)
     args = parser.parse_args()
     main(args)
@@ -2,9 +2,49 @@ import pandas as pd
 from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 # import the dataset loader
-from src.data.dataset import load_dataset
+from src.data.dataset import (
+    iter_dataset,
+    write_table,
+    write_row_ids,
+    TABLE_EXTENSIONS,
+    ROW_IDS_EXTENSION,
+    ARTICLE_STORE_NAME,
+)
+
+# ================================================
+# Helper functions
+# ================================================
+
+
+def create_concept_index(dataset):
+    """Maps each concept to the set of row IDs of the articles containing it"""
+    concept_index = {}
+    for row, concepts in enumerate(dataset["concepts"]):
+        for concept in concepts:
+            concept_index.setdefault(concept, set()).add(row)
+    return concept_index
+
+
+def get_concept_rows(concept_index, concepts, n_rows):
+    """Gets the sorted row IDs of the articles containing all concepts"""
+    if len(concepts) == 0:
+        return list(range(n_rows))
+    # intersect the smallest sets first
+    row_sets = sorted((concept_index[c] for c in concepts), key=len)
+    return sorted(set.intersection(*row_sets))
+
+
+def write_partition(dataset, rows, file_path, format, as_row_ids=False):
+    """Writes the concept partition"""
+    if as_row_ids:
+        write_row_ids(f"{file_path}{ROW_IDS_EXTENSION}", rows)
+    else:
+        c_df = dataset.iloc[rows]
+        write_table(c_df, f"{file_path}{TABLE_EXTENSIONS[format]}", format=format)
+
 
 # ================================================
 # Main function
@@ -13,29 +53,53 @@ from src.data.dataset import load_dataset
 
 def main(args):
     # load the articles
-    dataset = load_dataset(args.articles_dir, dataType="processed")
-    dataset = pd.DataFrame(dataset)
+    dataset = pd.DataFrame.from_records(
+        iter_dataset(args.articles_dir, dataType="processed")
+    )
 
-    # list of all unique concepts
-    unique_concepts = dataset["concepts"].drop_duplicates().to_list()
+    # list of all unique concepts (in order of their appearance)
+    unique_concepts = list(dict.fromkeys(tuple(c) for c in dataset["concepts"]))
+    # map the concepts to the articles containing them
+    concept_index = create_concept_index(dataset)
 
     # create the concept directory
     Path(args.concepts_dir).mkdir(parents=True, exist_ok=True)
+    if args.row_ids:
+        # store the articles once and reference them by their row IDs
+        file_path = f"{args.concepts_dir}/{ARTICLE_STORE_NAME}"
+        write_table(
+            dataset, f"{file_path}{TABLE_EXTENSIONS[args.format]}", format=args.format
+        )
 
-    # iterate through the concepts and create the csvs
-    for concepts in tqdm(unique_concepts, desc="concepts"):
-        # get the mask IDs of the articles containing the concepts
-        mask = dataset["concepts"].apply(lambda x: all(item in x for item in concepts))
-        c_df = dataset[mask]
+    # iterate through the concepts and write the partitions
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for concepts in unique_concepts:
+            # get the row IDs of the articles containing the concepts
+            rows = get_concept_rows(concept_index, concepts, len(dataset))
 
-        name = "__".join([str(y) for y in concepts])
-        file_path = f"{args.concepts_dir}/{name}.csv"
-        c_df.to_csv(file_path, encoding="utf-8", index=True)
+            name = "__".join([str(y) for y in concepts])
+            file_path = f"{args.concepts_dir}/{name}"
+            futures.append(
+                executor.submit(
+                    write_partition,
+                    dataset,
+                    rows,
+                    file_path,
+                    args.format,
+                    args.row_ids,
+                )
+            )
+        for future in tqdm(futures, desc="concepts"):
+            future.result()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--articles_dir", type=str)
     parser.add_argument("--concepts_dir", type=str)
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv"])
+    parser.add_argument("--workers", default=4, type=int)
+    parser.add_argument("--row_ids", action="store_true")
     args = parser.parse_args()
     main(args)
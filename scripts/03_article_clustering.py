@@ -1,8 +1,12 @@
+import os
 import ast
 import warnings
+import multiprocessing as mp
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from os import listdir
-from os.path import isfile, join, exists, basename, dirname
+from os.path import isfile, join, exists, getsize, basename, dirname
 
 import torch
 import pandas as pd
@@ -10,12 +14,43 @@ from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
 
-from src.utils.NewsArticle import NewsArticle
+import src.utils.NewsArticle as news_article
+from src.utils.NewsArticle import (
+    NewsArticle,
+    embed_articles,
+    extract_named_entities,
+    set_embedding_store,
+)
 from src.utils.NewsEventMonitor import NewsEventMonitor
+from src.utils.MonitorCheckpoint import has_checkpoint, remove_checkpoint
+from src.data.dataset import (
+    read_table,
+    write_table,
+    read_row_ids,
+    get_table_format,
+    get_table_path,
+    get_article_store,
+    ROW_IDS_EXTENSION,
+    ARTICLE_STORE_NAME,
+)
 from src.models.PairBERT import PairBERT
+from src.models.ModelRegistry import registry, set_use_gpu
 
 warnings.simplefilter(action="ignore")
 
+# the article columns used by the clustering
+ARTICLE_COLUMNS = [
+    "title",
+    "body",
+    "lang",
+    "source",
+    "dateTime",
+    "url",
+    "uri",
+    "eventUri",
+    "concepts",
+]
+
 # ================================================
 # Helper functions
 # ================================================
@@ -50,14 +85,30 @@ def create_dataframe(event_monitor):
             "eventUri",
             "concepts",
             "clusterId",
+            "namedEntities",
         ],
     )
     df.index.name = "id"
     return df
 
 
-def load_articles(input_file, run_as_test):
-    df = pd.read_csv(
+@lru_cache(maxsize=1)
+def read_article_store(store_file):
+    """Reads the article store shared by the row ID partitions"""
+    return read_articles(store_file)
+
+
+def read_articles(input_file):
+    if input_file.endswith(ROW_IDS_EXTENSION):
+        # resolve the partition rows in the shared article store
+        store = read_article_store(get_article_store(dirname(input_file)))
+        return store.iloc[read_row_ids(input_file)]
+
+    if get_table_format(input_file) == "parquet":
+        # read only the used columns
+        return read_table(input_file, columns=ARTICLE_COLUMNS)
+
+    return pd.read_csv(
         input_file,
         dtype={
             "id": "int",
@@ -74,6 +125,10 @@ def load_articles(input_file, run_as_test):
         index_col=False,
     )
 
+
+def load_articles(input_file, run_as_test):
+    df = read_articles(input_file)
+
     # Some news dont have titles (end with an error) we drop those news
     df = df.drop(df[df["title"].isnull()].index)
     df = df[:100] if run_as_test else df
@@ -86,6 +141,12 @@ def load_articles(input_file, run_as_test):
     return articles
 
 
+@lru_cache(maxsize=1)
+def load_compare_model(compare_model_path):
+    """Loads the compare model onto the CPU once per process"""
+    return PairBERT.load_from_checkpoint(compare_model_path, map_location="cpu")
+
+
 def cluster_and_save_articles(
     input_file,
     output_file,
@@ -95,38 +156,60 @@ def cluster_and_save_articles(
     compare_th,
     compare_model_path,
     compare_ne,
+    compare_select="best",
     run_as_test=False,
     is_multilingual=False,
+    index_backend="exact",
     use_gpu=False,
+    checkpoint_dir=None,
+    checkpoint_every=1000,
 ):
     if use_gpu and not torch.cuda.is_available():
         warnings.warn("GPU not available, using CPU")
 
     device = torch.device("cuda" if use_gpu and torch.cuda.is_available() else "cpu")
 
-    compare_model = PairBERT.load_from_checkpoint(compare_model_path)
-
-    # load the compare model onto the GPU
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    compare_model = compare_model.to(device)
+    # load the compare model onto the selected device
+    compare_model = load_compare_model(compare_model_path).to(device)
 
     event_monitor = NewsEventMonitor(
-        sim_th=sim_th,
-        time_th_in_days=time_th_in_days,
-        time_metric=time_metric,
-        compare_th=compare_th,
+        sim_threshold=sim_th,
+        time_threshold_in_days=time_th_in_days,
+        time_compare_stat=time_metric,
+        compare_threshold=compare_th,
         compare_model=compare_model,
         compare_ne=compare_ne,
+        compare_select=compare_select,
         is_multilingual=is_multilingual,
+        index_backend=index_backend,
     )
 
     articles = load_articles(input_file, run_as_test)
-    for article in tqdm(articles, desc=input_file.split("/")[-1]):
+
+    offset = 0
+    checkpoint_path = None
+    if checkpoint_dir is not None:
+        checkpoint_path = join(checkpoint_dir, basename(input_file))
+    if checkpoint_path and has_checkpoint(checkpoint_path):
+        # resume from the last snapshot
+        offset = event_monitor.load_checkpoint(checkpoint_path, articles)
+
+    # embed the remaining articles in batches
+    embed_articles(articles[offset:])
+    if compare_ne:
+        # extract the named entities in batches
+        extract_named_entities(articles[offset:])
+    for idx in tqdm(range(offset, len(articles)), desc=input_file.split("/")[-1]):
         # specify where we compare the articles
-        event_monitor.update(article, device=device)
+        event_monitor.update(articles[idx], device=device)
+        if checkpoint_path and (idx + 1) % checkpoint_every == 0:
+            event_monitor.save_checkpoint(checkpoint_path, articles, idx + 1)
 
     df = create_dataframe(event_monitor)
-    df.to_csv(output_file, encoding="utf-8", index=True)
+    write_table(df, output_file)
+    if checkpoint_path:
+        # the snapshot is not needed anymore
+        remove_checkpoint(checkpoint_path)
 
 
 # ================================================
@@ -134,38 +217,102 @@ def cluster_and_save_articles(
 # ================================================
 
 
+def init_worker(n_threads, embedding_cache, use_gpu):
+    """Initializes the worker process"""
+    # avoid oversubscribing the cores with the intra-op threads
+    torch.set_num_threads(n_threads)
+    # the spawned processes do not inherit the registry configuration
+    set_use_gpu(use_gpu)
+    set_embedding_store(embedding_cache)
+
+
+def run_clustering(kwargs):
+    """Clusters the articles of a single file"""
+    cluster_and_save_articles(**kwargs)
+    if news_article.embedding_store is not None:
+        news_article.embedding_store.flush()
+    return kwargs["input_file"]
+
+
 def main(args):
+    # load the LM and NER models onto the selected device
+    set_use_gpu(args.use_gpu)
+
     if isfile(args.input_dir):
         input_dir = dirname(args.input_dir)
         files = [basename(args.input_dir)]
     else:
         input_dir = args.input_dir
-        files = [f for f in listdir(input_dir) if isfile(join(input_dir, f))]
+        files = [
+            f
+            for f in listdir(input_dir)
+            if isfile(join(input_dir, f)) and not f.startswith(ARTICLE_STORE_NAME)
+        ]
+    # process the largest files first
+    files = sorted(files, key=lambda file: getsize(join(input_dir, file)), reverse=True)
 
     # create the results directory
     Path(args.output_dir).mkdir(parents=True, exist_ok=True)
-    for file in tqdm(files, desc="Files"):
-        if exists(f"{args.output_dir}/{file}") and not args.override:
+
+    jobs = []
+    for file in files:
+        output_file = get_table_path(f"{args.output_dir}/{file}", args.format)
+        if exists(output_file) and not args.override:
             continue
-        cluster_and_save_articles(
-            input_file=f"{input_dir}/{file}",
-            output_file=f"{args.output_dir}/{file}",
-            sim_th=args.sim_th,
-            time_th_in_days=args.time_th_in_days,
-            time_metric=args.time_metric,
-            compare_th=args.compare_th,
-            compare_model_path=args.compare_model_path,
-            compare_ne=args.compare_ne,
-            is_multilingual=args.is_multilingual,
-            run_as_test=args.test,
-            use_gpu=args.use_gpu,
+        jobs.append(
+            {
+                "input_file": f"{input_dir}/{file}",
+                "output_file": output_file,
+                "sim_th": args.sim_th,
+                "time_th_in_days": args.time_th_in_days,
+                "time_metric": args.time_metric,
+                "compare_th": args.compare_th,
+                "compare_model_path": args.compare_model_path,
+                "compare_ne": args.compare_ne,
+                "compare_select": args.compare_select,
+                "is_multilingual": args.is_multilingual,
+                "index_backend": args.index_backend,
+                "run_as_test": args.test,
+                "use_gpu": args.use_gpu,
+                "checkpoint_dir": args.checkpoint_dir,
+                "checkpoint_every": args.checkpoint_every,
+            }
         )
 
+    if args.workers <= 1:
+        # consult the persistent embedding store
+        set_embedding_store(args.embedding_cache)
+        for job in tqdm(jobs, desc="Files"):
+            run_clustering(job)
+        return
+
+    # CUDA cannot be used in forked processes
+    context = mp.get_context("spawn" if args.use_gpu else "fork")
+    if not args.use_gpu:
+        # the models stay on the CPU, so they are loaded before forking
+        # and shared copy-on-write
+        registry.get("embed")
+        if args.compare_ne:
+            registry.get("ner")
+        load_compare_model(args.compare_model_path)
+
+    n_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(n_threads, args.embedding_cache, args.use_gpu),
+    ) as executor:
+        futures = [executor.submit(run_clustering, job) for job in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Files"):
+            future.result()
+
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--input_dir", default=None, type=str)
     parser.add_argument("--output_dir", default=None, type=str)
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv"])
     parser.add_argument("--sim_th", default=0.8, type=float)
     parser.add_argument("--time_th_in_days", default=2, type=int)
     parser.add_argument("--time_metric", default="min", type=str)
@@ -176,8 +323,16 @@ if __name__ == "__main__":
         type=str,
     )
     parser.add_argument("--compare_ne", default=True, type=bool)
+    parser.add_argument("--compare_select", default="best", choices=["best", "first"])
     parser.add_argument("--is_multilingual", action="store_true")
+    parser.add_argument(
+        "--index_backend", default="exact", choices=["exact", "ivf", "hnsw"]
+    )
+    parser.add_argument("--embedding_cache", default=None, type=str)
     parser.add_argument("--use_gpu", action="store_true")
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--checkpoint_dir", default=None, type=str)
+    parser.add_argument("--checkpoint_every", default=1000, type=int)
     parser.add_argument("--override", action="store_true")
     parser.add_argument("--test", action="store_true")
     args = parser.parse_args()
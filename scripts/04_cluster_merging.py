@@ -8,14 +8,39 @@ import torch
 import pandas as pd
 from tqdm import tqdm
 from pathlib import Path
-from argparse import ArgumentParser
+from argparse import ArgumentParser, BooleanOptionalAction
 
 from src.utils.NewsEvent import NewsEvent
 from src.utils.MultiNewsEventMonitor import MultiNewsEventMonitor
-from src.utils.NewsArticle import NewsArticle
+from src.utils.MonitorCheckpoint import has_checkpoint, remove_checkpoint
+from src.utils.NewsArticle import (
+    NewsArticle,
+    embed_articles,
+    set_embedding_store,
+)
+from src.data.dataset import (
+    read_table,
+    write_table,
+    get_table_format,
+    get_table_path,
+)
 
 warnings.simplefilter(action="ignore")
 
+# the article columns used by the cluster merging
+ARTICLE_COLUMNS = [
+    "title",
+    "body",
+    "lang",
+    "source",
+    "dateTime",
+    "url",
+    "uri",
+    "eventUri",
+    "concepts",
+    "clusterId",
+]
+
 # ================================================
 # Helper functions
 # ================================================
@@ -50,35 +75,28 @@ def create_dataframe(event_monitor):
             "eventUri",
             "concepts",
             "clusterId",
+            "namedEntities",
         ],
     )
     df.index.name = "id"
     return df
 
 
-def load_events(input_file, run_as_test):
+def read_articles(input_file):
+    if get_table_format(input_file) == "parquet":
+        # read only the used columns
+        return read_table(input_file, columns=ARTICLE_COLUMNS)
+
+    # read only the used columns by their header names, so that the files
+    # with and without the named entities column are both supported
     df = pd.read_csv(
         input_file,
-        names=[
-            "id",
-            "title",
-            "body",
-            "lang",
-            "source",
-            "dateTime",
-            "url",
-            "uri",
-            "eventUri",
-            "concepts",
-            "clusterId",
-        ],
+        usecols=ARTICLE_COLUMNS,
         dtype={
-            "id": "Int64",
             "title": "str",
             "body": "str",
             "lang": "str",
             "source": "str",
-            "dateTime": "str",
             "url": "str",
             "uri": "str",
             "eventUri": "str",
@@ -88,30 +106,47 @@ def load_events(input_file, run_as_test):
         parse_dates=["dateTime"],
         on_bad_lines="warn",
         engine="python",
-        skiprows=1,
     )
+    df["concepts"] = df["concepts"].apply(lambda x: literal_converter(x))
+    return df
+
+
+def group_articles(records):
+    """Groups the articles by their cluster ID in a single pass
+
+    The groups are in the order of their first article and the articles
+    keep the order of the records. Records without a cluster ID are skipped.
+    """
+    groups = {}
+    for record in tqdm(records, desc="File load"):
+        if record["clusterId"] is None:
+            continue
+        groups.setdefault(record["clusterId"], []).append(NewsArticle(record))
+    return list(groups.values())
+
+
+def load_event_articles(input_file, run_as_test):
+    df = read_articles(input_file)
 
     # Some news dont have titles (end with an error) we drop those news
     df = df[df["title"].notna() & df["title"].notnull()]
 
     # reset the ID column
     df = df.sort_values(by="dateTime")
-    df["concepts"] = df["concepts"].apply(lambda x: literal_converter(x))
     df = df.where(df.notnull() & df.notna(), None)
 
-    cluster_ids = df["clusterId"].unique()
-    cluster_ids = cluster_ids[:200] if run_as_test else cluster_ids
+    # create the news articles of each event
+    event_articles = group_articles(df.to_dict("records"))
+    event_articles = event_articles[:200] if run_as_test else event_articles
+    return event_articles
+
+
+def load_events(event_articles):
+    # embed the articles in batches
+    embed_articles([a for articles in event_articles for a in articles])
 
     # create the news events list
-    events = [
-        NewsEvent(
-            articles=[
-                NewsArticle(a)
-                for a in df[df["clusterId"] == cluster_id].to_dict("records")
-            ]
-        )
-        for cluster_id in tqdm(cluster_ids, desc="File load")
-    ]
+    events = [NewsEvent(articles=articles) for articles in event_articles]
     return events
 
 
@@ -122,10 +157,17 @@ def cluster_and_save_events(
     time_th_in_days,
     w_reg,
     w_nit,
+    w_tol,
+    w_batch_size,
+    w_block_size,
     filter_cls,
     filter_cls_n,
+    filter_cls_min_sim=None,
+    index_backend="exact",
     use_gpu=False,
     run_as_test=False,
+    checkpoint_dir=None,
+    checkpoint_every=100,
 ):
     if use_gpu and not torch.cuda.is_available():
         warnings.warn("GPU not available, using CPU")
@@ -136,18 +178,45 @@ def cluster_and_save_events(
         time_th_in_days=time_th_in_days,
         w_reg=w_reg,
         w_nit=w_nit,
+        w_tol=w_tol,
+        w_batch_size=w_batch_size,
+        w_block_size=w_block_size,
         filter_cls=filter_cls,
         filter_cls_n=filter_cls_n,
+        filter_cls_min_sim=filter_cls_min_sim,
         device=device,
+        index_backend=index_backend,
     )
 
-    events = load_events(input_file, run_as_test)
-    for event in tqdm(events, desc=input_file.split("/")[-1]):
+    event_articles = load_event_articles(input_file, run_as_test)
+    # the snapshots reference the articles in the input order
+    articles = [a for e_articles in event_articles for a in e_articles]
+
+    offset = 0
+    checkpoint_path = None
+    if checkpoint_dir is not None:
+        checkpoint_path = join(checkpoint_dir, basename(input_file))
+    if checkpoint_path and has_checkpoint(checkpoint_path):
+        # resume from the last snapshot
+        offset = event_monitor.load_checkpoint(checkpoint_path, articles)
+
+    events = load_events(event_articles[offset:])
+    for idx, event in enumerate(tqdm(events, desc=input_file.split("/")[-1])):
         # specify where we compare the articles
         event_monitor.update(event)
+        if checkpoint_path and (offset + idx + 1) % checkpoint_every == 0:
+            event_monitor.save_checkpoint(checkpoint_path, articles, offset + idx + 1)
+
+    wasserstein = event_monitor.wasserstein
+    if wasserstein.total_calls > 0:
+        avg_iters = wasserstein.total_iter / wasserstein.total_calls
+        print("Average sinkhorn iterations".ljust(50, ".") + f"{avg_iters:.1f}")
 
     df = create_dataframe(event_monitor)
-    df.to_csv(output_file, encoding="utf-8", index=True)
+    write_table(df, output_file)
+    if checkpoint_path:
+        # the snapshot is not needed anymore
+        remove_checkpoint(checkpoint_path)
 
 
 # ================================================
@@ -168,34 +237,57 @@ def main(args):
 
     # create the results directory
     Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    # consult the persistent embedding store
+    embedding_store = set_embedding_store(args.embedding_cache)
     for file in tqdm(files, desc="Files"):
-        if exists(f"{args.output_dir}/{file}") and not args.override:
-            print("Skipping", f"{args.output_dir}/{file}")
+        output_file = get_table_path(f"{args.output_dir}/{file}", args.format)
+        if exists(output_file) and not args.override:
+            print("Skipping", output_file)
             continue
         cluster_and_save_events(
             input_file=f"{input_dir}/{file}",
-            output_file=f"{args.output_dir}/{file}",
+            output_file=output_file,
             sim_th=args.sim_th,
             time_th_in_days=args.time_th_in_days,
             w_reg=args.w_reg,
             w_nit=args.w_nit,
+            w_tol=args.w_tol,
+            w_batch_size=args.w_batch_size,
+            w_block_size=args.w_block_size,
             filter_cls=args.filter_cls,
             filter_cls_n=args.filter_cls_n,
+            filter_cls_min_sim=args.filter_cls_min_sim,
+            index_backend=args.index_backend,
             use_gpu=args.use_gpu,
             run_as_test=args.test,
+            checkpoint_dir=args.checkpoint_dir,
+            checkpoint_every=args.checkpoint_every,
         )
+        if embedding_store is not None:
+            embedding_store.flush()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--input_dir", default=None, type=str)
     parser.add_argument("--output_dir", default=None, type=str)
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv"])
     parser.add_argument("--sim_th", default=0.93, type=float)
     parser.add_argument("--time_th_in_days", default=1, type=float)
     parser.add_argument("--w_reg", default=0.1, type=float)
     parser.add_argument("--w_nit", default=100, type=int)
-    parser.add_argument("--filter_cls", action="store_true")
+    parser.add_argument("--w_tol", default=1e-6, type=float)
+    parser.add_argument("--w_batch_size", default=64, type=int)
+    parser.add_argument("--w_block_size", default=1024, type=int)
+    parser.add_argument("--filter_cls", default=True, action=BooleanOptionalAction)
     parser.add_argument("--filter_cls_n", default=10, type=int)
+    parser.add_argument("--filter_cls_min_sim", default=None, type=float)
+    parser.add_argument(
+        "--index_backend", default="exact", choices=["exact", "ivf", "hnsw"]
+    )
+    parser.add_argument("--embedding_cache", default=None, type=str)
+    parser.add_argument("--checkpoint_dir", default=None, type=str)
+    parser.add_argument("--checkpoint_every", default=100, type=int)
     parser.add_argument("--use_gpu", action="store_true")
     parser.add_argument("--override", action="store_true")
     parser.add_argument("--test", action="store_true")
@@ -1,4 +1,8 @@
+import os
 import ast
+import heapq
+import hashlib
+import tempfile
 import pandas as pd
 
 from os import listdir
@@ -8,9 +12,55 @@ from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
 
-from src.utils.NewsEvent import NewsEventBase
 from src.utils.NewsArticle import NewsArticle
+from src.data.dataset import iter_table, get_table_format, TableWriter
 
+# ================================================
+# Static variables
+# ================================================
+
+# the number of rows read and written at once
+CHUNK_SIZE = 10000
+
+# the number of rows read at once from each spilled run
+RUN_BATCH_SIZE = 1000
+
+# the options of the manual evaluation csv files
+CSV_OPTIONS = {
+    "names": [
+        "id",
+        "title",
+        "body",
+        "lang",
+        "source",
+        "dateTime",
+        "url",
+        "uri",
+        "eventUri",
+        "concepts",
+        "clusterId",
+        "namedEntities",
+        "wikiConcepts",
+    ],
+    "dtype": {
+        "id": "Int64",
+        "title": "str",
+        "body": "str",
+        "lang": "str",
+        "source": "str",
+        "url": "str",
+        "uri": "str",
+        "eventUri": "str",
+        "concepts": "str",
+        "clusterId": "str",
+        "namedEntities": "str",
+        "wikiConcepts": "str",
+    },
+    "parse_dates": ["dateTime"],
+    "on_bad_lines": "warn",
+    "engine": "python",
+    "skiprows": 1,
+}
 
 # ================================================
 # Helper functions
@@ -24,75 +74,103 @@ def literal_converter(val):
         return val
 
 
-def create_events(df):
-    clusterIds = df["clusterId"].unique()
-
-    events = [
-        NewsEventBase(
-            articles=[
-                NewsArticle(a)
-                for a in df[df["clusterId"] == clusterId].to_dict("records")
-            ]
+def read_article_chunks(input_file, columns=None):
+    """Reads the articles of the file in chunks"""
+    if get_table_format(input_file) == "parquet":
+        chunks = iter_table(input_file, columns=columns, batch_size=CHUNK_SIZE)
+    else:
+        chunks = pd.read_csv(
+            input_file, usecols=columns, chunksize=CHUNK_SIZE, **CSV_OPTIONS
+        )
+    for df in chunks:
+        yield df.drop(columns=["wikiConcepts", "namedEntities"], errors="ignore")
+
+
+def scan_file(input_file):
+    """Checks if the file is sorted by time and counts its clusters"""
+    is_sorted = True
+    last_time = None
+    cluster_ids = set()
+    for df in read_article_chunks(input_file, columns=["dateTime", "clusterId"]):
+        if len(df) == 0:
+            continue
+        times = df["dateTime"]
+        if not times.is_monotonic_increasing or (
+            last_time is not None and times.iloc[0] < last_time
+        ):
+            is_sorted = False
+        last_time = times.iloc[-1]
+        cluster_ids.update(df["clusterId"].dropna())
+    return is_sorted, len(cluster_ids)
+
+
+def spill_run(chunks, run_path):
+    """Sorts the articles by time and writes them into the run file"""
+    df = pd.concat(chunks).sort_values(by="dateTime", kind="stable")
+    writer = TableWriter(run_path, format="parquet")
+    writer.write(df.reset_index(drop=True))
+    writer.close()
+    return run_path
+
+
+def spill_runs(input_file, run_size, tmp_dir):
+    """Sorts the articles of the file into runs spilled to disk
+
+    At most run_size articles are kept in memory at once.
+    """
+    runs, run, n_rows = [], [], 0
+    file_name = os.path.basename(input_file)
+    for df in read_article_chunks(input_file):
+        run.append(df)
+        n_rows += len(df)
+        if n_rows >= run_size:
+            run_path = os.path.join(tmp_dir, f"{file_name}-{len(runs):05d}.parquet")
+            runs.append(spill_run(run, run_path))
+            run, n_rows = [], 0
+    if len(run) > 0:
+        run_path = os.path.join(tmp_dir, f"{file_name}-{len(runs):05d}.parquet")
+        runs.append(spill_run(run, run_path))
+    return runs
+
+
+def iter_records(chunks):
+    """Yields the records of the dataframe chunks"""
+    for df in chunks:
+        yield from df.to_dict("records")
+
+
+def iter_articles(input_file, runs, first_cluster_id):
+    """Yields the articles of the file in time order with new cluster IDs
+
+    The clusters are numbered in the order of their first article, i.e. in
+    the order of their minimum time. The files that are not sorted by time
+    are read from their sorted runs (see spill_runs), which are merged.
+    """
+    if runs is None:
+        records = iter_records(read_article_chunks(input_file))
+    else:
+        # merge the sorted runs (ties keep the run order)
+        records = heapq.merge(
+            *[iter_records(iter_table(p, batch_size=RUN_BATCH_SIZE)) for p in runs],
+            key=lambda record: record["dateTime"],
         )
-        for clusterId in clusterIds
-    ]
-    events = sorted(events, key=lambda e: e.min_time)
-    return events
 
-
-def load_events(input_file):
-    df = pd.read_csv(
-        input_file,
-        names=[
-            "id",
-            "title",
-            "body",
-            "lang",
-            "source",
-            "dateTime",
-            "url",
-            "uri",
-            "eventUri",
-            "concepts",
-            "clusterId",
-            "namedEntities",
-            "wikiConcepts",
-        ],
-        dtype={
-            "id": "Int64",
-            "title": "str",
-            "body": "str",
-            "lang": "str",
-            "source": "str",
-            "dateTime": "str",
-            "url": "str",
-            "uri": "str",
-            "eventUri": "str",
-            "concepts": "str",
-            "clusterId": "str",
-            "namedEntities": "str",
-            "wikiConcepts": "str",
-        },
-        parse_dates=["dateTime"],
-        on_bad_lines="warn",
-        engine="python",
-        skiprows=1,
-    )
-    # dataframe sorting and init
-    df.drop(columns=["wikiConcepts", "namedEntities"], inplace=True)
-    df.sort_values(by="dateTime", inplace=True)
-    events = create_events(df)
-    return df, events
+    cluster_ids = {}
+    for record in records:
+        if pd.isna(record["clusterId"]):
+            continue
+        if record["clusterId"] not in cluster_ids:
+            cluster_id = first_cluster_id + len(cluster_ids)
+            cluster_ids[record["clusterId"]] = f"wn-{cluster_id}"
+        article = NewsArticle(record)
+        article.cluster_id = cluster_ids[record["clusterId"]]
+        yield article
 
 
-def create_dataframe(events, drop_duplicates=False):
-    """Store all articles into the dataframe"""
+def create_dataframe(articles, start_index=0):
+    """Store the articles into the dataframe"""
 
-    data = [
-        article.to_array()[:-2]
-        for event in tqdm(events, desc="Event prep")
-        for article in event.articles
-    ]
+    data = [article.to_array()[:-2] for article in articles]
     df = pd.DataFrame(
         data,
         columns=[
@@ -107,21 +185,14 @@ def create_dataframe(events, drop_duplicates=False):
             "concepts",
             "clusterId",
         ],
+        index=pd.RangeIndex(start_index, start_index + len(data), name="id"),
     )
-    df.sort_values(by="dateTime", inplace=True)
-    if drop_duplicates:
-        df.drop_duplicates(["uri"], keep="first", inplace=True)
-    df.reset_index(drop=True, inplace=True)
-    df.index.name = "id"
     return df
 
 
-def assign_new_cluster_ids(events, last_index=1):
-    cluster_id = last_index
-    for event in events:
-        event.assign_cluster_id(f"wn-{cluster_id}")
-        cluster_id += 1
-    return cluster_id
+def get_uri_key(uri):
+    """Gets the compact key of the article URI"""
+    return hashlib.blake2b(str(uri).encode("utf8"), digest_size=8).digest()
 
 
 # ================================================
@@ -137,15 +208,37 @@ def main(args):
     ]
     Path(args.merge_file_path).parent.mkdir(parents=True, exist_ok=True)
 
-    all_events = []
-    last_index = 1
-    for file in tqdm(event_files, desc="Files"):
-        _, events = load_events(f"{args.manual_eval_dir}/{file}")
-        last_index = assign_new_cluster_ids(events, last_index)
-        all_events = all_events + events
-
-    df = create_dataframe(all_events, args.drop_duplicates)
-    df.to_csv(args.merge_file_path, encoding="utf-8", index=True)
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        # get the cluster ID offsets of the files
+        file_articles = []
+        first_cluster_id = 1
+        for file in tqdm(event_files, desc="Files"):
+            input_file = f"{args.manual_eval_dir}/{file}"
+            is_sorted, n_clusters = scan_file(input_file)
+            # sort the files that are not sorted by time in spilled runs
+            runs = None if is_sorted else spill_runs(input_file, args.run_size, tmp_dir)
+            file_articles.append(iter_articles(input_file, runs, first_cluster_id))
+            first_cluster_id += n_clusters
+
+        # merge the files in time order
+        articles = heapq.merge(*file_articles, key=lambda article: article.time)
+
+        seen_uris = set()
+        writer = TableWriter(args.merge_file_path, format=args.format)
+        n_written, chunk = 0, []
+        for article in tqdm(articles, desc="Merge"):
+            if args.drop_duplicates:
+                uri_key = get_uri_key(article.uri)
+                if uri_key in seen_uris:
+                    continue
+                seen_uris.add(uri_key)
+            chunk.append(article)
+            if len(chunk) == CHUNK_SIZE:
+                writer.write(create_dataframe(chunk, n_written))
+                n_written, chunk = n_written + len(chunk), []
+        if len(chunk) > 0 or n_written == 0:
+            writer.write(create_dataframe(chunk, n_written))
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -153,6 +246,9 @@ if __name__ == "__main__":
     parser.add_argument("--manual_eval_dir", default=None, type=str)
     parser.add_argument("--merge_file_path", default=None, type=str)
     parser.add_argument("--drop_duplicates", action="store_true")
+    parser.add_argument("--format", default=None, choices=["parquet", "csv"])
+    parser.add_argument("--run_size", default=100000, type=int)
+    parser.add_argument("--tmp_dir", default=None, type=str)
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,121 @@
+import torch
+import torch.nn.functional as f
+from argparse import ArgumentParser
+
+from src.utils.CentroidIndex import (
+    CentroidIndex,
+    create_centroid_index,
+    benchmark_centroid_index,
+    benchmark_drifting_centroid_index,
+)
+
+# ================================================
+# Helper functions
+# ================================================
+
+
+class CentroidEvent:
+    """The placeholder event containing only the centroid"""
+
+    def __init__(self, centroid):
+        self.centroid = centroid
+        self.centroid_indices = []
+
+
+def get_topics(n_topics, dim):
+    """Generates the normalized random topics"""
+    return f.normalize(torch.randn(n_topics, dim), p=2, dim=1)
+
+
+def get_vectors(topics, n_vectors, noise):
+    """Generates normalized vectors clustered around the topics"""
+    assign = torch.randint(0, topics.shape[0], (n_vectors,))
+    vectors = topics[assign] + noise * torch.randn(n_vectors, topics.shape[1])
+    return f.normalize(vectors, p=2, dim=1)
+
+
+def get_drifting_vectors(topics, n_vectors, noise, drift):
+    """Generates the event and query vectors around the drifting topics
+
+    The topics take a random walk step of the size drift after each vector.
+    """
+    vectors, queries = [], []
+    for _ in range(n_vectors):
+        vectors.append(get_vectors(topics, 1, noise)[0])
+        queries.append(get_vectors(topics, 1, noise)[0])
+        step = f.normalize(torch.randn(topics.shape), p=2, dim=1)
+        topics = f.normalize(topics + drift * step, p=2, dim=1)
+    return torch.stack(vectors), torch.stack(queries)
+
+
+def run_static(args, backend):
+    """Benchmarks the index containing all events"""
+    topics = get_topics(args.n_topics, args.dim)
+    vectors = get_vectors(topics, args.n_events, args.noise)
+    queries = get_vectors(topics, args.n_queries, args.noise)
+
+    events = [CentroidEvent(vector) for vector in vectors]
+    exact = CentroidIndex()
+    index = create_centroid_index(backend)
+    for event in events:
+        exact.add(event)
+        index.add(event)
+    return benchmark_centroid_index(index, exact, queries, k=args.k)
+
+
+def run_drift(args, backend):
+    """Benchmarks the index on a sliding window of drifting events"""
+    topics = get_topics(args.n_topics, args.dim)
+    vectors, queries = get_drifting_vectors(
+        topics, args.n_events, args.noise, args.drift
+    )
+    events = [CentroidEvent(vector) for vector in vectors]
+    return benchmark_drifting_centroid_index(
+        create_centroid_index(backend),
+        CentroidIndex(),
+        events,
+        queries,
+        window=args.window,
+        query_every=args.query_every,
+        k=args.k,
+    )
+
+
+# ================================================
+# Main function
+# ================================================
+
+
+def main(args):
+    for backend in args.backends:
+        # generate the same events for every backend
+        torch.manual_seed(args.seed)
+        if args.workload == "static":
+            results = run_static(args, backend)
+        else:
+            results = run_drift(args, backend)
+        print(
+            f"{backend.ljust(6)} "
+            f"recall@{args.k}={results['recall']:.4f} "
+            f"latency={results['latency']:.3f}ms "
+            f"exact_latency={results['exact_latency']:.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--n_events", default=10000, type=int)
+    parser.add_argument("--n_queries", default=1000, type=int)
+    parser.add_argument("--n_topics", default=500, type=int)
+    parser.add_argument("--dim", default=768, type=int)
+    parser.add_argument("--noise", default=0.05, type=float)
+    parser.add_argument("--workload", default="static", choices=["static", "drift"])
+    parser.add_argument("--drift", default=0.005, type=float)
+    parser.add_argument("--window", default=2000, type=int)
+    parser.add_argument("--query_every", default=10, type=int)
+    parser.add_argument("--k", default=10, type=int)
+    parser.add_argument("--backends", default=["exact", "ivf", "hnsw"], nargs="+")
+    parser.add_argument("--seed", default=1, type=int)
+    args = parser.parse_args()
+
+    main(args)
@@ -1,8 +1,13 @@
+import io
 import os
+import re
 import json
+import numpy as np
 from tqdm import tqdm
 import pathlib
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # static data location
 DATA_PATHS = {
@@ -14,6 +19,41 @@ DATA_PATHS = {
     ),
 }
 
+# the number of bytes in a file chunk parsed by a single worker
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# the patterns of the fixed datetime formats parsed without strptime
+FAST_DATETIME_PATTERNS = {
+    "%Y-%m-%d": re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2})"),
+    "%Y-%m-%d %H:%M:%S": re.compile(
+        r"([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})"
+    ),
+    "%Y-%m-%dT%H:%M:%SZ": re.compile(
+        r"([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})Z"
+    ),
+}
+
+
+def parse_datetime(value: str, format: str):
+    """Parses the datetime with a fast path for the fixed formats
+
+    Values that do not strictly match the format layout are parsed with
+    strptime, so the result is always the same as the strptime one.
+
+    Args:
+        value (str): The datetime string.
+        format (str): The strptime format of the datetime.
+    """
+    pattern = FAST_DATETIME_PATTERNS.get(format)
+    match = pattern.fullmatch(value) if pattern else None
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            # let strptime handle the invalid values
+            pass
+    return datetime.strptime(value, format)
+
 
 def format_article(article, dataType="processed"):
     DATE_FORMAT = "%Y-%m-%d" if dataType == "raw" else "%Y-%m-%d %H:%M:%S"
@@ -21,42 +61,328 @@ def format_article(article, dataType="processed"):
 
     return {
         **article,
-        "date": datetime.strptime(article["date"], DATE_FORMAT)
+        "date": parse_datetime(article["date"], DATE_FORMAT)
         if article["date"]
         else None,
-        "dateTime": datetime.strptime(article["dateTime"], DATETIME_FORMAT)
+        "dateTime": parse_datetime(article["dateTime"], DATETIME_FORMAT)
         if article["dateTime"]
         else None,
-        "dateTimePub": datetime.strptime(article["dateTimePub"], DATETIME_FORMAT)
+        "dateTimePub": parse_datetime(article["dateTimePub"], DATETIME_FORMAT)
         if article["dateTimePub"]
         else None,
     }
 
 
-def load_dataset(fpath: str = DATA_PATHS["processed"], dataType="processed"):
-    """Get all of the articles in a single array
+def get_file_attrs(file: str, dataType="processed"):
+    """Gets the attributes added to all articles of the file"""
+    add_attrs = {}
+    if dataType == "raw":
+        concepts = file.replace(".jsonl", "").split("-")[0]
+        add_attrs["concepts"] = concepts.split("&")
+    return add_attrs
+
+
+def get_dataset_files(fpath: str, dataType="processed"):
+    """Gets the dataset files and their attributes in the loading order"""
+    files = []
+    for file in os.listdir(fpath):
+        filepath = os.path.join(fpath, file)
+        if os.path.isfile(filepath):
+            files.append((filepath, get_file_attrs(file, dataType)))
+        else:
+            files.extend(get_dataset_files(filepath, dataType))
+    return files
+
+
+def get_file_chunks(filepath: str, chunk_size: int = CHUNK_SIZE):
+    """Splits the file into byte ranges ending with a new line"""
+    chunks = []
+    file_size = os.path.getsize(filepath)
+    with open(filepath, mode="rb") as file:
+        start = 0
+        while start < file_size:
+            file.seek(min(start + chunk_size, file_size))
+            # move the chunk end to the end of the line
+            file.readline()
+            end = min(file.tell(), file_size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def load_chunk(filepath: str, start: int, end: int, dataType: str, add_attrs: dict):
+    """Parses the articles in the byte range of the file"""
+    with open(filepath, mode="rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    # decode the lines the same way as the files opened in text mode
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf8")
+    return [
+        {**format_article(json.loads(line), dataType), **add_attrs} for line in lines
+    ]
+
+
+def iter_dataset_parallel(
+    fpath: str = DATA_PATHS["processed"],
+    dataType="processed",
+    workers: int = 4,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """Iterate through the articles parsed in a process pool
+
+    The files are split into chunks that are parsed by the workers. The
+    articles are yielded in the same order as the ones of iter_dataset.
 
     Args:
         fpath (str): The directory path from which we wish to collect the data.
+        workers (int): The number of worker processes.
+        chunk_size (int): The approximate number of bytes in a chunk.
     """
-    articles = []
+    tasks = [
+        (filepath, start, end, dataType, add_attrs)
+        for filepath, add_attrs in get_dataset_files(fpath, dataType)
+        for start, end in get_file_chunks(filepath, chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a bounded number of chunks in flight
+        futures = deque()
+        for task in tqdm(tasks, desc="Loading chunks"):
+            futures.append(executor.submit(load_chunk, *task))
+            if len(futures) > 2 * workers:
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
+
+
+def iter_dataset(
+    fpath: str = DATA_PATHS["processed"],
+    dataType="processed",
+    workers: int = 1,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """Iterate through the articles of the directory tree
+
+    The files are read line by line, so the articles are yielded lazily
+    in the same order as the ones returned by load_dataset.
+
+    Args:
+        fpath (str): The directory path from which we wish to collect the data.
+        workers (int): The number of worker processes. If greater than one,
+            the files are parsed with iter_dataset_parallel. Default to 1.
+        chunk_size (int): The approximate number of bytes in a chunk parsed
+            by a worker. Default to 64MB.
+    """
+    if workers > 1:
+        yield from iter_dataset_parallel(fpath, dataType, workers, chunk_size)
+        return
+
     # iterate through all of the files and folders
     for file in tqdm(os.listdir(fpath), desc="Loading files"):
         filepath = os.path.join(fpath, file)
         if os.path.isfile(filepath):
-            add_attrs = {}
-            if dataType == "raw":
-                concepts = file.replace(".jsonl", "").split("-")[0]
-                add_attrs["concepts"] = concepts.split("&")
+            add_attrs = get_file_attrs(file, dataType)
             # open the file and retrieve all of the article metadata
             with open(filepath, mode="r", encoding="utf8") as file:
-                articles = articles + [
-                    {**format_article(json.loads(line), dataType), **add_attrs}
-                    for line in file.readlines()
-                ]
+                for line in file:
+                    yield {**format_article(json.loads(line), dataType), **add_attrs}
+        else:
+            # yield the directory articles
+            yield from iter_dataset(filepath, dataType)
+
+
+def load_dataset(
+    fpath: str = DATA_PATHS["processed"], dataType="processed", workers: int = 1
+):
+    """Get all of the articles in a single array
+
+    Args:
+        fpath (str): The directory path from which we wish to collect the data.
+        workers (int): The number of worker processes. Default to 1.
+    """
+    return list(iter_dataset(fpath, dataType, workers=workers))
+
+
+# ===============================================
+# Table Interchange
+# ===============================================
+
+# the supported table formats and their file extensions
+TABLE_EXTENSIONS = {"parquet": ".parquet", "csv": ".csv"}
+# the extension of the partitions referencing the rows of the article store
+ROW_IDS_EXTENSION = ".ids"
+# the name of the article store shared by the row ID partitions
+ARTICLE_STORE_NAME = "_articles"
+
+
+def get_table_format(path: str):
+    """Gets the table format from the file extension"""
+    extension = os.path.splitext(path)[1]
+    return "parquet" if extension == TABLE_EXTENSIONS["parquet"] else "csv"
+
+
+def get_table_path(path: str, format: str):
+    """Replaces the file extension with the one of the table format"""
+    if format not in TABLE_EXTENSIONS:
+        raise Exception(f"Unsupported table format: {format}")
+    return os.path.splitext(path)[0] + TABLE_EXTENSIONS[format]
+
+
+def to_python_list(value):
+    """Converts the list cell into a python list
+
+    The nested lists (e.g. the named entity pairs) are converted into
+    tuples so that they can be stored in sets.
+    """
+    if not isinstance(value, (list, np.ndarray)):
+        return value
+    return [
+        tuple(item) if isinstance(item, (list, np.ndarray)) else item
+        for item in value
+    ]
+
+
+def is_list_type(type):
+    """Checks if the arrow type is a list type"""
+    import pyarrow as pa
+
+    return pa.types.is_list(type) or pa.types.is_large_list(type)
+
+
+def read_table(path: str, columns: list = None, filters: list = None):
+    """Reads the parquet table into a dataframe
+
+    Args:
+        path (str): The path of the parquet file.
+        columns (list): The columns to be read. If None, all columns are read.
+        filters (list): The pyarrow row filters, e.g. [("lang", "=", "eng")].
+    Returns:
+        df (pd.DataFrame): The table with the list columns as python lists.
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=columns, filters=filters)
+    df = table.to_pandas()
+    for field in table.schema:
+        if field.name in df.columns and is_list_type(field.type):
+            df[field.name] = df[field.name].apply(to_python_list)
+    return df
+
+
+def iter_table(path: str, columns: list = None, batch_size: int = 10000):
+    """Reads the parquet table in chunks
+
+    Args:
+        path (str): The path of the parquet file.
+        columns (list): The columns to be read. If None, all columns are read.
+        batch_size (int): The maximum number of rows in a chunk.
+    Returns:
+        chunks (Iterator[pd.DataFrame]): The chunks with the list columns as
+            python lists.
+    """
+    import pyarrow.parquet as pq
+
+    file = pq.ParquetFile(path)
+    for batch in file.iter_batches(batch_size=batch_size, columns=columns):
+        df = batch.to_pandas()
+        for field in batch.schema:
+            if field.name in df.columns and is_list_type(field.type):
+                df[field.name] = df[field.name].apply(to_python_list)
+        yield df
+
+
+def write_table(df, path: str, format: str = None):
+    """Writes the dataframe in the table format
+
+    Args:
+        df (pd.DataFrame): The dataframe to be written.
+        path (str): The path of the output file.
+        format (str): The table format ("parquet" or "csv"). If None, it is
+            inferred from the file extension.
+    """
+    format = format or get_table_format(path)
+    if format == "parquet":
+        df.to_parquet(path, engine="pyarrow", index=True)
+    elif format == "csv":
+        df.to_csv(path, encoding="utf-8", index=True)
+    else:
+        raise Exception(f"Unsupported table format: {format}")
+
+
+def write_row_ids(path: str, rows: list):
+    """Writes the row IDs of the partition, one per line"""
+    with open(path, mode="w", encoding="utf8") as file:
+        for row in rows:
+            file.write(f"{row}\n")
+
+
+def read_row_ids(path: str):
+    """Reads the row IDs of the partition"""
+    with open(path, mode="r", encoding="utf8") as file:
+        return [int(line) for line in file]
+
+
+def get_article_store(dirpath: str):
+    """Gets the path of the article store in the directory"""
+    for extension in TABLE_EXTENSIONS.values():
+        store_path = os.path.join(dirpath, f"{ARTICLE_STORE_NAME}{extension}")
+        if os.path.isfile(store_path):
+            return store_path
+    raise Exception(f"Article store not found in {dirpath}")
+
+
+class TableWriter:
+    """Writes the dataframe chunks into a single table"""
+
+    def __init__(self, path: str, format: str = None) -> None:
+        """Initializes the table writer
+        Args:
+            path (str): The path of the output file.
+            format (str): The table format ("parquet" or "csv"). If None, it
+                is inferred from the file extension.
+        """
+        self.path = path
+        self.format = format or get_table_format(path)
+        if self.format not in TABLE_EXTENSIONS:
+            raise Exception(f"Unsupported table format: {self.format}")
+        self.writer = None
+        self.schema = None
+        self.n_chunks = 0
+
+    def write(self, df) -> None:
+        """Appends the dataframe chunk to the table
+        Args:
+            df (pd.DataFrame): The chunk with the same columns as the
+                previous ones.
+        """
+        if self.format == "csv":
+            df.to_csv(
+                self.path,
+                encoding="utf-8",
+                index=True,
+                mode="w" if self.n_chunks == 0 else "a",
+                header=self.n_chunks == 0,
+            )
         else:
-            # append the directory articles
-            articles = articles + load_dataset(filepath, dataType)
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self.writer is None:
+                # the columns without values in the first chunk are strings
+                table = pa.Table.from_pandas(df, preserve_index=True)
+                fields = [
+                    field.with_type(pa.string())
+                    if pa.types.is_null(field.type)
+                    else field
+                    for field in table.schema
+                ]
+                self.schema = pa.schema(fields, metadata=table.schema.metadata)
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=True)
+            self.writer.write_table(table)
+        self.n_chunks += 1
 
-    # return the articles
-    return articles
+    def close(self) -> None:
+        """Closes the table file"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
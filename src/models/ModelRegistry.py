@@ -0,0 +1,117 @@
+import threading
+from functools import partial
+from typing import Any, Callable, Dict
+
+# ===============================================
+# Define the Model Registry
+# ===============================================
+
+
+class ModelRegistry:
+    """The process-wide registry of lazily loaded models"""
+
+    factories: Dict[str, Callable[[], Any]]
+    models: Dict[str, Any]
+
+    def __init__(self) -> None:
+        self.factories = {}
+        self.models = {}
+        self.lock = threading.Lock()
+
+    # ==================================
+    # Default Override Methods
+    # ==================================
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    # ==================================
+    # Class Methods
+    # ==================================
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """Registers the model factory
+        Args:
+            name (str): The name of the model.
+            factory (Callable[[], Any]): The function creating the model. It is
+                called the first time the model is requested.
+        """
+        self.factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        """Gets the model and loads it on first use
+        Args:
+            name (str): The name of the model.
+        Returns:
+            model (Any): The shared model instance.
+        """
+        if name not in self.models:
+            with self.lock:
+                if name not in self.models:
+                    if name not in self.factories:
+                        raise Exception(f"Unsupported model name: {name}")
+                    self.models[name] = self.factories[name]()
+        return self.models[name]
+
+    def set(self, name: str, model: Any) -> None:
+        """Injects the model instance
+        Args:
+            name (str): The name of the model.
+            model (Any): The model instance used instead of the default one.
+        """
+        with self.lock:
+            self.models[name] = model
+
+    def reset(self, name: str) -> None:
+        """Releases the model instance; it is reloaded on next use
+        Args:
+            name (str): The name of the model.
+        """
+        with self.lock:
+            self.models.pop(name, None)
+
+
+# ===============================================
+# Default Models
+# ===============================================
+
+
+# the configuration of the default LM
+EMBED_MODEL_CONFIG = {"model_type": "sbert", "pooling_type": "mean"}
+
+
+def load_embed_model(use_gpu: bool = True):
+    from src.models.MultilingualLM import MultilingualLM
+
+    return MultilingualLM(**EMBED_MODEL_CONFIG, use_gpu=use_gpu).eval()
+
+
+def get_embed_model_id() -> str:
+    """Gets the identity of the LM without loading the default one"""
+    if "embed" in registry:
+        return registry.get("embed").model_id
+
+    from src.models.MultilingualLM import get_model_id
+
+    return get_model_id(**EMBED_MODEL_CONFIG)
+
+
+def load_ner_model(use_gpu: bool = True):
+    from src.models.MultilingualNER import MultilingualNER
+
+    return MultilingualNER(use_gpu=use_gpu).eval()
+
+
+registry = ModelRegistry()
+registry.register("embed", load_embed_model)
+registry.register("ner", load_ner_model)
+
+
+def set_use_gpu(use_gpu: bool) -> None:
+    """Sets if the default models are loaded onto the GPU
+    Args:
+        use_gpu (bool): If the default models are loaded onto the GPU (when
+            available). Only the models loaded afterwards are affected.
+    """
+    registry.register("embed", partial(load_embed_model, use_gpu=use_gpu))
+    registry.register("ner", partial(load_ner_model, use_gpu=use_gpu))
@@ -3,6 +3,35 @@ import torch.nn as nn
 import torch.nn.functional as f
 from transformers import AutoModel, AutoTokenizer
 
+from typing import List, Optional
+
+# the pretrained models of the supported model types
+MODEL_NAMES = {
+    "mbert": "bert-base-multilingual-cased",
+    "distilbert": "distilbert-base-multilingual-cased",
+    "xlmroberta": "xlm-roberta-base",
+    "sbert": "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
+}
+
+
+def get_max_seq_length(model_type: str) -> int:
+    """Gets the maximum sequence length of the model type"""
+    return 128 if model_type == "sbert" else 512
+
+
+def get_model_id(model_type: str = "sbert", pooling_type: str = "mean") -> str:
+    """Gets the identity of the model without loading it
+    Args:
+        model_type (str): The language model used to generate the embeddings.
+        pooling_type (str): The embedding pooling type.
+    Returns:
+        model_id (str): The identity used to address the model embeddings.
+    """
+    if model_type not in MODEL_NAMES:
+        raise Exception(f"Unsupported model type: {model_type}")
+    model_name = MODEL_NAMES[model_type]
+    return f"{model_name}:{pooling_type}:{get_max_seq_length(model_type)}"
+
 
 class MultilingualLM(nn.Module):
     def __init__(
@@ -30,28 +59,27 @@ class MultilingualLM(nn.Module):
         self.model_type = model_type
         self.pooling_type = pooling_type
         # set the maximum sequence length
-        self.max_seq_length = 128 if self.model_type == "sbert" else 512
-
-        if self.model_type == "mbert":
-            model_name = "bert-base-multilingual-cased"
-        elif self.model_type == "distilbert":
-            model_name = "distilbert-base-multilingual-cased"
-        elif self.model_type == "xlmroberta":
-            model_name = "xlm-roberta-base"
-        elif self.model_type == "sbert":
-            model_name = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
-        else:
+        self.max_seq_length = get_max_seq_length(self.model_type)
+
+        if self.model_type not in MODEL_NAMES:
             raise Exception(f"Unsupported model type: {self.model_type}")
+        model_name = MODEL_NAMES[self.model_type]
 
         if self.pooling_type not in ["cls", "max", "mean"]:
             raise Exception(f"Unsupported pooling type: {self.pooling_type}")
 
+        self.model_name = model_name
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() and use_gpu else "cpu"
         )
         self.model = AutoModel.from_pretrained(model_name).to(self.device)
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
 
+    @property
+    def model_id(self) -> str:
+        """The identity of the model used to address its embeddings"""
+        return get_model_id(self.model_type, self.pooling_type)
+
     @torch.no_grad()
     def forward(self, text: str) -> torch.Tensor:
         """Generates the document embedding.
@@ -66,6 +94,61 @@ class MultilingualLM(nn.Module):
             max_length=self.max_seq_length,
             return_tensors="pt",
         )
+        return self._embed_encodings(encodings)
+
+    @torch.no_grad()
+    def embed_batch(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        token_budget: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Generates the document embeddings of multiple texts.
+        The texts are sorted by their token length and grouped into buckets
+        of similar length, which minimizes the padding in each forward pass.
+        Args:
+            texts (List[str]): The texts to be embedded.
+            batch_size (int): The maximum number of texts in a bucket.
+                Default to 32.
+            token_budget (int): The maximum number of (padded) tokens in a
+                bucket. If None, only the batch_size is used. Default to None.
+        Returns:
+            embeddings (torch.Tensor): The (len(texts), dim) matrix of the text
+                embeddings in the same order as the input texts.
+        """
+        if len(texts) == 0:
+            return torch.empty((0, self.model.config.hidden_size))
+
+        # tokenize without padding to get the token lengths
+        encodings = self.tokenizer(
+            texts, truncation=True, max_length=self.max_seq_length
+        )
+        input_ids = encodings["input_ids"]
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+
+        embeddings = None
+        for bucket in get_length_buckets(
+            [len(input_ids[i]) for i in order], batch_size, token_budget
+        ):
+            ids = [order[i] for i in bucket]
+            batch = self.tokenizer.pad(
+                {k: [v[i] for i in ids] for k, v in encodings.items()},
+                padding=True,
+                return_tensors="pt",
+            )
+            embeds = self._embed_encodings(batch)
+            if embeddings is None:
+                # allocate the contiguous output matrix
+                embeddings = torch.empty((len(texts), embeds.shape[1]))
+            # store the embeddings in the original order
+            embeddings[ids] = embeds
+        return embeddings
+
+    def _embed_encodings(self, encodings) -> torch.Tensor:
+        """Generates the normalized embeddings of the tokenized texts.
+        Args:
+            encodings (dict): The tokenizer output.
+        """
         encodings = {k: v.to(self.device) for k, v in encodings.items()}
 
         # get query embeddings
@@ -106,3 +189,30 @@ def mean_pooling(model_output, attn_mask):
     sum_embeddings = torch.sum(token_embeds * input_mask_expanded, 1)
     sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
     return sum_embeddings / sum_mask
+
+
+def get_length_buckets(
+    lengths: List[int], batch_size: int = 32, token_budget: Optional[int] = None
+) -> List[List[int]]:
+    """Groups the sorted sequence lengths into buckets
+    Args:
+        lengths (List[int]): The sequence lengths sorted in ascending order.
+        batch_size (int): The maximum number of sequences in a bucket.
+        token_budget (int): The maximum number of padded tokens in a bucket,
+            i.e. the bucket size times its longest sequence length.
+    Returns:
+        buckets (List[List[int]]): The list of buckets containing the
+            positions of the sequences.
+    """
+    buckets, bucket = [], []
+    for idx, length in enumerate(lengths):
+        too_large = len(bucket) == batch_size or (
+            token_budget is not None and (len(bucket) + 1) * length > token_budget
+        )
+        if bucket and too_large:
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(idx)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
@@ -3,6 +3,8 @@ import torch.nn as nn
 from transformers import AutoModelForTokenClassification, AutoTokenizer
 from transformers import pipeline
 
+from typing import List
+
 
 class MultilingualNER(nn.Module):
     def __init__(self, use_gpu: bool = False):
@@ -25,5 +27,34 @@ class MultilingualNER(nn.Module):
 
     @torch.no_grad()
     def forward(self, text: str):
-        ner_results = self.ner_pipeline(text)
+        ner_results = self.extract_batch([text], batch_size=1)[0]
+        return ner_results
+
+    @torch.no_grad()
+    def extract_batch(
+        self, texts: List[str], batch_size: int = 16, stride: int = 64
+    ) -> List[List[dict]]:
+        """Extracts the named entities of multiple texts
+        The texts longer than the model input are split into overlapping
+        token windows, whose entity spans are merged back per text by the
+        pipeline. The texts are sorted by length so that the batches
+        contain windows of similar lengths.
+        Args:
+            texts (List[str]): The texts.
+            batch_size (int): The number of windows in a batch.
+            stride (int): The number of overlapping tokens of the windows.
+        Returns:
+            ner_results (List[List[dict]]): The named entities of each text
+                in the input order.
+        """
+        if len(texts) == 0:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        results = self.ner_pipeline(
+            [texts[i] for i in order], batch_size=batch_size, stride=stride
+        )
+
+        ner_results = [None] * len(texts)
+        for idx, result in zip(order, results):
+            ner_results[idx] = result
         return ner_results
@@ -76,23 +76,44 @@ class PairBERT(pl.LightningModule):
             input2
         ), "The length of input1 is not the same as the length of input2"
 
-        # get the inputs' encodings
-        encoded_input1 = self.tokenizer(
-            input1, padding=True, truncation=True, return_tensors="pt"
-        )
-        encoded_input2 = self.tokenizer(
-            input2, padding=True, truncation=True, return_tensors="pt"
+        # get the inputs' embeddings
+        embedding_input1 = self.encode(input1, device)
+        embedding_input2 = self.encode(input2, device)
+        return self.score_embeddings(embedding_input1, embedding_input2)
+
+    @torch.no_grad()
+    def encode(self, texts: List[str], device=None):
+        """Calculates the normalized embeddings of the texts
+
+        Args:
+            texts (List[str]): The texts to be encoded.
+            device (torch.device): The device on which the texts are encoded.
+
+        Returns:
+            Tensor: The (len(texts), dim) tensor of the text embeddings.
+        """
+        encoded_input = self.tokenizer(
+            texts, padding=True, truncation=True, return_tensors="pt"
         )
         if device:
-            encoded_input1 = encoded_input1.to(device)
-            encoded_input2 = encoded_input2.to(device)
+            encoded_input = encoded_input.to(device)
+        return self._get_embeddings(encoded_input)
 
-        # get the inputs' embeddings
-        embedding_input1 = self._get_embeddings(encoded_input1)
-        embedding_input2 = self._get_embeddings(encoded_input2)
+    @torch.no_grad()
+    def score_embeddings(self, embeddings1, embeddings2):
+        """Classifies if the encoded texts should be paired or not
 
+        Args:
+            embeddings1 (Tensor): The embeddings of the first texts. A single
+                embedding is compared to all of the second embeddings.
+            embeddings2 (Tensor): The embeddings of the second texts.
+
+        Returns:
+            Tensor: The pairing scores.
+        """
+        embeddings1 = embeddings1.expand_as(embeddings2)
         # scale the cosine values from [-1, 1] to [0, 1]
-        logits = (1 + self.cos(embedding_input1, embedding_input2)) / 2
+        logits = (1 + self.cos(embeddings1, embeddings2)) / 2
         return logits
 
     def configure_optimizers(self):
@@ -0,0 +1,471 @@
+import time
+import torch
+import warnings
+
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# ===============================================
+# Define the Centroid Index
+# ===============================================
+
+
+class CentroidIndex:
+    """The contiguous centroid matrix of the active events
+
+    Each event occupies one row (slot) of the matrix. The slots of removed
+    events are reused by the new events and the matrix grows by doubling its
+    capacity. The event updates its row in place whenever its centroid changes.
+    """
+
+    matrix: Optional[torch.Tensor]
+    events: List[Optional[object]]
+    free_slots: List[int]
+    slots: Dict[int, int]
+
+    def __init__(self, capacity: int = 64) -> None:
+        """Initializes the centroid index
+        Args:
+            capacity (int): The initial number of slots. Default to 64.
+        """
+        self.capacity = capacity
+        self.matrix = None
+        self.mask = None
+        self.events = []
+        self.free_slots = []
+        self.slots = {}
+
+    # ==================================
+    # Default Override Methods
+    # ==================================
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, event) -> bool:
+        return id(event) in self.slots
+
+    # ==================================
+    # Class Methods
+    # ==================================
+
+    def add(self, event) -> None:
+        """Adds the event centroid to the index
+        Args:
+            event (NewsEvent): The event to be added.
+        """
+        if self.matrix is None:
+            self.matrix = torch.zeros((self.capacity, event.centroid.shape[0]))
+            self.mask = torch.full((self.capacity,), float("-inf"))
+
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+            self.events[slot] = event
+        else:
+            slot = len(self.events)
+            if slot == self.matrix.shape[0]:
+                self._grow()
+            self.events.append(event)
+
+        self.slots[id(event)] = slot
+        self.matrix[slot] = event.centroid
+        self.mask[slot] = 0
+        event.centroid_indices.append(self)
+
+    def update(self, event) -> None:
+        """Updates the event centroid in place
+        Args:
+            event (NewsEvent): The event with the updated centroid.
+        """
+        self.matrix[self.slots[id(event)]] = event.centroid
+
+    def remove(self, event) -> None:
+        """Removes the event centroid and frees its slot
+        Args:
+            event (NewsEvent): The event to be removed.
+        """
+        slot = self.slots.pop(id(event))
+        self.events[slot] = None
+        self.mask[slot] = float("-inf")
+        self.free_slots.append(slot)
+        event.centroid_indices.remove(self)
+
+    def search(
+        self,
+        vector: torch.Tensor,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+    ) -> Tuple[torch.Tensor, list]:
+        """Gets the events with the most similar centroids
+        Args:
+            vector (torch.Tensor): The normalized query vector.
+            k (int): The maximum number of returned events. If None, all
+                events are considered. Default to None.
+            threshold (float): If given, only events with the similarity
+                greater than the threshold are returned. Default to None.
+        Returns:
+            sims (torch.Tensor): The similarities in descending order.
+            events (list): The corresponding events.
+        """
+        if len(self.slots) == 0:
+            return torch.empty(0), []
+
+        n_slots = len(self.events)
+        sims = self.matrix[:n_slots].mv(vector) + self.mask[:n_slots]
+        k = len(self.slots) if k is None else min(k, len(self.slots))
+        if threshold is not None:
+            k = min(k, int((sims > threshold).sum()))
+        sims, indices = torch.topk(sims, k)
+        return sims, [self.events[idx] for idx in indices.tolist()]
+
+    # ==================================
+    # Helper Methods
+    # ==================================
+
+    def _grow(self) -> None:
+        """Doubles the capacity of the centroid matrix"""
+        n_slots, dim = self.matrix.shape
+        matrix = torch.zeros((2 * n_slots, dim))
+        matrix[:n_slots] = self.matrix
+        mask = torch.full((2 * n_slots,), float("-inf"))
+        mask[:n_slots] = self.mask
+        self.matrix, self.mask = matrix, mask
+
+
+# ===============================================
+# Define the Approximate Centroid Indices
+# ===============================================
+
+
+class IVFCentroidIndex(CentroidIndex):
+    """The inverted file centroid index
+
+    The event centroids are assigned to the closest of the n_lists coarse
+    centroids, which are trained with k-means once the index contains
+    train_size events. Since the active events drift over time, the coarse
+    centroids are retrained (warm-started) after every retrain_every
+    insertions. Each coarse centroid keeps the set of its slots, so the
+    search only scans the events of the n_probe coarse centroids most
+    similar to the query vector.
+    """
+
+    lists: List[Set[int]]
+    assignments: Dict[int, int]
+
+    def __init__(
+        self,
+        capacity: int = 64,
+        n_lists: int = 32,
+        n_probe: int = 4,
+        train_size: int = 1024,
+        n_iter: int = 10,
+        retrain_every: Optional[int] = None,
+    ) -> None:
+        """Initializes the centroid index
+        Args:
+            capacity (int): The initial number of slots. Default to 64.
+            n_lists (int): The number of coarse centroids. Default to 32.
+            n_probe (int): The number of searched coarse centroids. Default to 4.
+            train_size (int): The number of events needed to train the coarse
+                centroids. Until then, the exact search is used. Default to 1024.
+            n_iter (int): The number of k-means iterations. Default to 10.
+            retrain_every (int): The number of insertions after which the
+                coarse centroids are retrained. If None, train_size is used.
+                Default to None.
+        """
+        super().__init__(capacity)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_size = max(train_size, n_lists)
+        self.n_iter = n_iter
+        self.retrain_every = retrain_every or self.train_size
+        self.coarse = None
+        # the slots of each coarse centroid and the coarse centroid of each slot
+        self.lists = []
+        self.assignments = {}
+        self.n_inserts = 0
+
+    def add(self, event) -> None:
+        super().add(event)
+        self.n_inserts += 1
+        if self.coarse is None and len(self) >= self.train_size:
+            self._train()
+        elif self.coarse is not None and self.n_inserts >= self.retrain_every:
+            self._train()
+        elif self.coarse is not None:
+            self._assign(self.slots[id(event)])
+
+    def update(self, event) -> None:
+        super().update(event)
+        if self.coarse is not None:
+            self._assign(self.slots[id(event)])
+
+    def remove(self, event) -> None:
+        slot = self.slots[id(event)]
+        super().remove(event)
+        if self.coarse is not None:
+            self.lists[self.assignments.pop(slot)].discard(slot)
+
+    def search(
+        self,
+        vector: torch.Tensor,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+    ) -> Tuple[torch.Tensor, list]:
+        if self.coarse is None or len(self) == 0:
+            return super().search(vector, k=k, threshold=threshold)
+
+        # get the slots assigned to the closest coarse centroids
+        n_probe = min(self.n_probe, self.coarse.shape[0])
+        probe = torch.topk(self.coarse.mv(vector), n_probe).indices.tolist()
+        rows = [slot for list_id in probe for slot in self.lists[list_id]]
+        if len(rows) == 0:
+            return torch.empty(0), []
+        rows = torch.tensor(rows, dtype=torch.long)
+        sims = self.matrix[rows].mv(vector)
+
+        k = len(rows) if k is None else min(k, len(rows))
+        if threshold is not None:
+            k = min(k, int((sims > threshold).sum()))
+        sims, indices = torch.topk(sims, k)
+        return sims, [self.events[idx] for idx in rows[indices].tolist()]
+
+    def _train(self) -> None:
+        """Trains the coarse centroids with spherical k-means
+
+        The first training is initialized with evenly spaced events (to keep
+        the runs reproducible) and the retraining with the current coarse
+        centroids. All active slots are then reassigned.
+        """
+        n_slots = len(self.events)
+        rows = (self.mask[:n_slots] == 0).nonzero().squeeze(1)
+        X = self.matrix[rows]
+        if self.coarse is None:
+            init = torch.linspace(0, X.shape[0] - 1, self.n_lists).long()
+            coarse = X[init].clone()
+        else:
+            coarse = self.coarse.clone()
+        for _ in range(self.n_iter):
+            assign = X.matmul(coarse.T).argmax(dim=1)
+            for list_id in range(self.n_lists):
+                members = X[assign == list_id]
+                if members.shape[0] > 0:
+                    coarse[list_id] = torch.nn.functional.normalize(
+                        members.sum(dim=0), p=2, dim=0
+                    )
+        self.coarse = coarse
+
+        # rebuild the inverted lists
+        assign = X.matmul(coarse.T).argmax(dim=1)
+        self.lists = [set() for _ in range(self.n_lists)]
+        self.assignments = {}
+        for slot, list_id in zip(rows.tolist(), assign.tolist()):
+            self.lists[list_id].add(slot)
+            self.assignments[slot] = list_id
+        self.n_inserts = 0
+
+    def _assign(self, slot: int) -> None:
+        """Assigns the slot to the closest coarse centroid"""
+        list_id = int(self.coarse.mv(self.matrix[slot]).argmax())
+        if slot in self.assignments:
+            self.lists[self.assignments[slot]].discard(slot)
+        self.lists[list_id].add(slot)
+        self.assignments[slot] = list_id
+
+
+class HNSWCentroidIndex(CentroidIndex):
+    """The HNSW centroid index (requires the hnswlib package)
+
+    The graph labels are the index slots. The centroid updates replace the
+    vectors in the graph and the removed events are marked as deleted until
+    their slot is reused.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef: int = 100,
+        k: int = 50,
+    ) -> None:
+        """Initializes the centroid index
+        Args:
+            capacity (int): The initial number of slots. Default to 1024.
+            M (int): The number of graph links per element. Default to 16.
+            ef_construction (int): The construction search width. Default to 200.
+            ef (int): The query search width. Default to 100.
+            k (int): The number of retrieved neighbours when the search
+                is not limited by k. Default to 50.
+        """
+        if hnswlib is None:
+            raise ImportError("The HNSW centroid index requires hnswlib")
+        super().__init__(capacity)
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.k = k
+        self.graph = None
+
+    def add(self, event) -> None:
+        super().add(event)
+        if self.graph is None:
+            self.graph = hnswlib.Index(space="ip", dim=self.matrix.shape[1])
+            self.graph.init_index(
+                max_elements=self.matrix.shape[0],
+                ef_construction=self.ef_construction,
+                M=self.M,
+            )
+            self.graph.set_ef(self.ef)
+        elif self.graph.get_max_elements() < self.matrix.shape[0]:
+            self.graph.resize_index(self.matrix.shape[0])
+        self._insert(self.slots[id(event)])
+
+    def update(self, event) -> None:
+        super().update(event)
+        self._insert(self.slots[id(event)])
+
+    def remove(self, event) -> None:
+        slot = self.slots[id(event)]
+        super().remove(event)
+        self.graph.mark_deleted(slot)
+
+    def search(
+        self,
+        vector: torch.Tensor,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+    ) -> Tuple[torch.Tensor, list]:
+        if len(self) == 0:
+            return torch.empty(0), []
+
+        k = min(self.k if k is None else k, len(self))
+        labels, dists = self.graph.knn_query(vector.numpy(), k=k)
+        # the inner product distance is defined as 1 - <x, y>
+        sims = 1 - torch.from_numpy(dists[0])
+        slots = labels[0].tolist()
+        if threshold is not None:
+            slots = [slot for slot, sim in zip(slots, sims) if sim > threshold]
+            sims = sims[sims > threshold]
+        return sims, [self.events[slot] for slot in slots]
+
+    def _insert(self, slot: int) -> None:
+        """Inserts or replaces the slot vector in the graph"""
+        # existing and deleted labels are updated (and undeleted) in place
+        self.graph.add_items(self.matrix[slot].unsqueeze(0).numpy(), [slot])
+
+
+# ===============================================
+# Index Methods
+# ===============================================
+
+CENTROID_INDICES = {
+    "exact": CentroidIndex,
+    "ivf": IVFCentroidIndex,
+    "hnsw": HNSWCentroidIndex,
+}
+
+
+def create_centroid_index(backend: str = "exact", **kwargs) -> CentroidIndex:
+    """Creates the centroid index
+    Args:
+        backend (str): The index backend. Options:
+            "exact" - The brute-force search over the centroid matrix.
+            "ivf" - The inverted file approximate search.
+            "hnsw" - The HNSW approximate search (requires hnswlib).
+            Default to "exact".
+        **kwargs: The parameters of the index.
+    Returns:
+        index (CentroidIndex): The centroid index. If the backend is not
+            available, the exact index is used instead.
+    """
+    if backend not in CENTROID_INDICES:
+        raise Exception(f"Unsupported index backend: {backend}")
+    if backend == "hnsw" and hnswlib is None:
+        warnings.warn("hnswlib is not installed, using the exact centroid index")
+        return CentroidIndex()
+    return CENTROID_INDICES[backend](**kwargs)
+
+
+def benchmark_centroid_index(
+    index: CentroidIndex, exact: CentroidIndex, queries: torch.Tensor, k: int = 10
+) -> dict:
+    """Measures the recall and latency of the index against the exact search
+    Args:
+        index (CentroidIndex): The evaluated index.
+        exact (CentroidIndex): The exact index containing the same events.
+        queries (torch.Tensor): The (n_queries, dim) matrix of query vectors.
+        k (int): The number of retrieved events. Default to 10.
+    Returns:
+        results (dict): The average recall@k and the average query latency
+            (in milliseconds) of the index and of the exact search.
+    """
+    recalls, index_time, exact_time = [], 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        _, expected = exact.search(query, k=k)
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, retrieved = index.search(query, k=k)
+        index_time += time.perf_counter() - start
+
+        expected = {id(event) for event in expected}
+        retrieved = {id(event) for event in retrieved}
+        recalls.append(len(expected & retrieved) / max(len(expected), 1))
+
+    n_queries = queries.shape[0]
+    return {
+        "recall": sum(recalls) / n_queries,
+        "latency": 1000 * index_time / n_queries,
+        "exact_latency": 1000 * exact_time / n_queries,
+    }
+
+
+def benchmark_drifting_centroid_index(
+    index: CentroidIndex,
+    exact: CentroidIndex,
+    events: list,
+    queries: torch.Tensor,
+    window: int,
+    query_every: int = 10,
+    k: int = 10,
+) -> dict:
+    """Measures the recall and latency of the index on a sliding window
+
+    The events are inserted in their order into both indices and each event
+    is removed after window newer events are inserted, as the expired events
+    of the monitor. With drifting event centroids this measures how the
+    index copes with the changing active events.
+
+    Args:
+        index (CentroidIndex): The evaluated (empty) index.
+        exact (CentroidIndex): The (empty) exact index.
+        events (list): The events in the order of their insertion.
+        queries (torch.Tensor): The (len(events), dim) matrix of query
+            vectors; the i-th query is searched after the i-th insertion.
+        window (int): The number of active events.
+        query_every (int): The number of insertions between the searches.
+            Default to 10.
+        k (int): The number of retrieved events. Default to 10.
+    Returns:
+        results (dict): The average recall@k and the average query latency
+            (in milliseconds) of the index and of the exact search.
+    """
+    n_queries, results = 0, {"recall": 0.0, "latency": 0.0, "exact_latency": 0.0}
+    for idx, event in enumerate(events):
+        if idx >= window:
+            index.remove(events[idx - window])
+            exact.remove(events[idx - window])
+        index.add(event)
+        exact.add(event)
+        if idx % query_every == 0:
+            query = queries[idx].unsqueeze(0)
+            for key, value in benchmark_centroid_index(index, exact, query, k).items():
+                results[key] += value
+            n_queries += 1
+    return {key: value / max(n_queries, 1) for key, value in results.items()}
@@ -0,0 +1,178 @@
+import os
+import hashlib
+import numpy as np
+import torch
+
+from typing import Dict, Optional, Tuple
+
+# ===============================================
+# Define constants
+# ===============================================
+
+INDEX_FILE = "index.tsv"
+SHARD_FILE = "shard-{:05d}.npy"
+
+# ===============================================
+# Define the Embedding Store
+# ===============================================
+
+
+class EmbeddingStore:
+    """The persistent content-addressed embedding store
+
+    The embeddings are stored in memory-mapped float matrix shards. The index
+    maps the hash of the normalized text and the model identity to the shard
+    and row containing the embedding.
+    """
+
+    path: str
+    model_id: str
+    shard_size: int
+    index: Dict[str, Tuple[int, int]]
+
+    def __init__(self, path: str, model_id: str, shard_size: int = 10000) -> None:
+        """Opens (or creates) the embedding store
+        Args:
+            path (str): The directory containing the store.
+            model_id (str): The identity of the model generating the embeddings.
+            shard_size (int): The maximum number of embeddings kept in memory
+                before they are written into a new shard. Default to 10000.
+        """
+        self.path = path
+        self.model_id = model_id
+        self.shard_size = shard_size
+        self.index = {}
+        self.shards = {}
+        self.pending_keys = []
+        self.pending_embeds = []
+
+        os.makedirs(self.path, exist_ok=True)
+        self.n_shards = len(
+            [f for f in os.listdir(self.path) if f.startswith("shard-")]
+        )
+        self._load_index()
+
+    # ==================================
+    # Default Override Methods
+    # ==================================
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, text: str) -> bool:
+        return self.get_key(text) in self.index
+
+    # ==================================
+    # Class Methods
+    # ==================================
+
+    def get_key(self, text: str) -> str:
+        """Gets the key of the text
+        Args:
+            text (str): The text to be hashed.
+        Returns:
+            key (str): The hash of the normalized text and the model identity.
+        """
+        text = " ".join(text.split())
+        return hashlib.sha1(f"{self.model_id}\n{text}".encode("utf8")).hexdigest()
+
+    def get(self, text: str) -> Optional[torch.Tensor]:
+        """Gets the text embedding
+        Args:
+            text (str): The embedded text.
+        Returns:
+            embedding (Optional[torch.Tensor]): The stored embedding or None
+                if the text was not embedded yet.
+        """
+        key = self.get_key(text)
+        if key not in self.index:
+            return None
+
+        shard_id, row = self.index[key]
+        if shard_id == -1:
+            # the embedding is not yet written to disk
+            return self.pending_embeds[row]
+        return torch.tensor(self._get_shard(shard_id)[row])
+
+    def put(self, text: str, embedding: torch.Tensor) -> None:
+        """Stores the text embedding
+        Args:
+            text (str): The embedded text.
+            embedding (torch.Tensor): The text embedding.
+        """
+        key = self.get_key(text)
+        if key in self.index:
+            return
+
+        self.index[key] = (-1, len(self.pending_embeds))
+        self.pending_keys.append(key)
+        self.pending_embeds.append(embedding)
+        if len(self.pending_keys) >= self.shard_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the pending embeddings into a new shard"""
+        if len(self.pending_keys) == 0:
+            return
+
+        shard_id = self._reserve_shard()
+        embeds = torch.stack(self.pending_embeds).numpy().astype(np.float32)
+        with open(os.path.join(self.path, SHARD_FILE.format(shard_id)), "wb") as file:
+            np.save(file, embeds)
+        # the index is updated after the shard is written; the lines are
+        # appended with a single write so concurrent processes do not mix them
+        lines = "".join(
+            f"{key}\t{shard_id}\t{row}\n" for row, key in enumerate(self.pending_keys)
+        )
+        fd = os.open(
+            os.path.join(self.path, INDEX_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        )
+        try:
+            os.write(fd, lines.encode("utf8"))
+        finally:
+            os.close(fd)
+        for row, key in enumerate(self.pending_keys):
+            self.index[key] = (shard_id, row)
+
+        self.pending_keys = []
+        self.pending_embeds = []
+
+    # ==================================
+    # Helper Methods
+    # ==================================
+
+    def _reserve_shard(self) -> int:
+        """Creates the next free shard file and returns its ID
+
+        The file is created exclusively, so processes sharing the store
+        never write into the same shard.
+        """
+        while True:
+            shard_id = self.n_shards
+            self.n_shards += 1
+            try:
+                fd = os.open(
+                    os.path.join(self.path, SHARD_FILE.format(shard_id)),
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                )
+                os.close(fd)
+                return shard_id
+            except FileExistsError:
+                continue
+
+    def _load_index(self) -> None:
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.isfile(index_path):
+            return
+        with open(index_path, mode="r") as file:
+            for line in file:
+                key, shard_id, row = line.rstrip("\n").split("\t")
+                self.index[key] = (int(shard_id), int(row))
+
+    def _get_shard(self, shard_id: int) -> np.ndarray:
+        if shard_id not in self.shards:
+            # memory-map the shard on first access
+            self.shards[shard_id] = np.load(
+                os.path.join(self.path, SHARD_FILE.format(shard_id)), mmap_mode="r"
+            )
+        return self.shards[shard_id]
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+
+from typing import Callable, Dict, List, Tuple
+
+# ===============================================
+# Define the Expiration Queue
+# ===============================================
+
+
+class ExpirationQueue:
+    """The time-ordered queue of the active events
+
+    The events are kept in a min-heap keyed by their time. The keys are
+    re-evaluated lazily: when an event reaches the top of the heap with an
+    outdated key, it is pushed back with its current key. Events whose time
+    decreases must be re-keyed with the touch method.
+    """
+
+    heap: list
+    live: Dict[int, Tuple[int, float]]
+    inserted: Dict[int, int]
+
+    def __init__(self, get_time: Callable[[object], float]) -> None:
+        """Initializes the expiration queue
+        Args:
+            get_time (Callable[[object], float]): The function returning the
+                time used to expire the event.
+        """
+        self.get_time = get_time
+        self.heap = []
+        self.live = {}
+        self.inserted = {}
+        self.counter = itertools.count()
+
+    # ==================================
+    # Default Override Methods
+    # ==================================
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    def __contains__(self, event) -> bool:
+        return id(event) in self.live
+
+    # ==================================
+    # Class Methods
+    # ==================================
+
+    def push(self, event) -> None:
+        """Adds the event to the queue
+        Args:
+            event (NewsEvent): The event to be added.
+        """
+        self.inserted[id(event)] = next(self.counter)
+        self._push(event, self.get_time(event))
+
+    def touch(self, event) -> None:
+        """Re-keys the event if its time decreased
+        Args:
+            event (NewsEvent): The updated event.
+        """
+        time = self.get_time(event)
+        if time < self.live[id(event)][1]:
+            # the previous heap entry becomes stale
+            self._push(event, time)
+
+    def remove(self, event) -> None:
+        """Removes the event from the queue
+        Args:
+            event (NewsEvent): The event to be removed.
+        """
+        self.live.pop(id(event), None)
+        self.inserted.pop(id(event), None)
+
+    def pop_expired(self, time: float, threshold: float) -> List[object]:
+        """Removes the events older than the threshold
+        Assumes the events are updated in chronological order, i.e. the
+        event times are not greater than the given time.
+        Args:
+            time (float): The current time.
+            threshold (float): The time threshold.
+        Returns:
+            events (List[object]): The expired events in the reverse order of
+                their insertion into the queue.
+        """
+        expired = []
+        while len(self.heap) > 0 and threshold <= time - self.heap[0][0]:
+            key, seq, event = heapq.heappop(self.heap)
+            if self.live.get(id(event), (None,))[0] != seq:
+                # the entry is stale
+                continue
+            current = self.get_time(event)
+            if current != key:
+                # the event time changed since the entry was pushed
+                self._push(event, current)
+                continue
+            expired.append(event)
+
+        expired.sort(key=lambda event: self.inserted[id(event)], reverse=True)
+        for event in expired:
+            self.remove(event)
+        return expired
+
+    # ==================================
+    # Helper Methods
+    # ==================================
+
+    def _push(self, event, time: float) -> None:
+        seq = next(self.counter)
+        self.live[id(event)] = (seq, time)
+        heapq.heappush(self.heap, (time, seq, event))
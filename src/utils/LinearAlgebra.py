@@ -116,6 +116,63 @@ def update_centroid(
     return centroid, c_norm
 
 
+def update_centroid_bulk(
+    centroid: torch.Tensor, c_norm: float, n_articles: int, a_embeds: torch.Tensor
+) -> Tuple[torch.Tensor, float]:
+    """Updates the centroid with multiple articles
+    Updates the centroid with the following equations:
+        c_i = \\frac{n_{i-1} * ||c_{i-1}|| * c_{i-1} + \\sum_{j=1}^{k} a_{j}}{n_{i-1} + k}
+        c_i = \\frac{c_i}{||c_i||}
+    Args:
+        centroid (torch.Tensor): The current centroids tensor. Corresponds to
+            c_{i-1} in the equation.
+        c_norm (float): The current centroids norm. Corresponds to ||c_{i-1}||
+            in the equation.
+        n_articles (int): The previous number of articles in the cluster.
+            Corresponds to n_{i-1} in the equation.
+        a_embeds (torch.Tensor): The (k, dim) tensor of the new articles.
+            Corresponds to a_{j} in the equation.
+    Returns:
+        centroid (torch.Tensor): The updated normalized centroid.
+        c_norm (float): The updated centroids norm before normalization.
+    """
+    centroid = centroid * (n_articles * c_norm) + torch.sum(a_embeds, 0)
+    centroid /= n_articles + a_embeds.shape[0]
+    c_norm = torch.linalg.vector_norm(centroid, ord=2).item()
+    centroid = centroid / c_norm
+    return centroid, c_norm
+
+
+def merge_centroids(
+    centroid1: torch.Tensor,
+    c_norm1: float,
+    n_articles1: int,
+    centroid2: torch.Tensor,
+    c_norm2: float,
+    n_articles2: int,
+) -> Tuple[torch.Tensor, float]:
+    """Merges the centroids of two clusters
+    Merges the centroids with the following equations:
+        c = \\frac{n_1 * ||c_1|| * c_1 + n_2 * ||c_2|| * c_2}{n_1 + n_2}
+        c = \\frac{c}{||c||}
+    Args:
+        centroid1 (torch.Tensor): The normalized centroid of the first cluster.
+        c_norm1 (float): The centroid norm of the first cluster.
+        n_articles1 (int): The number of articles in the first cluster.
+        centroid2 (torch.Tensor): The normalized centroid of the second cluster.
+        c_norm2 (float): The centroid norm of the second cluster.
+        n_articles2 (int): The number of articles in the second cluster.
+    Returns:
+        centroid (torch.Tensor): The merged normalized centroid.
+        c_norm (float): The merged centroids norm before normalization.
+    """
+    centroid = centroid1 * (n_articles1 * c_norm1) + centroid2 * (n_articles2 * c_norm2)
+    centroid /= n_articles1 + n_articles2
+    c_norm = torch.linalg.vector_norm(centroid, ord=2).item()
+    centroid = centroid / c_norm
+    return centroid, c_norm
+
+
 # ===============================================
 # Statistics Methods
 # ===============================================
@@ -0,0 +1,247 @@
+import os
+import json
+import shutil
+import numpy as np
+import torch
+
+from typing import Dict, List, Tuple
+
+from src.utils.NewsEvent import NewsEvent
+from src.utils.NewsArticle import NewsArticle
+
+# ===============================================
+# Define constants
+# ===============================================
+
+STATE_FILE = "state.json"
+SHARD_FILE = "shard-{:05d}.json"
+EMBEDDINGS_FILE = "embeddings-{:05d}.npy"
+CENTROIDS_FILE = "centroids-{:05d}.npy"
+ACTIVE_CENTROIDS_FILE = "active-{:05d}.npy"
+
+# the suffix of the state file while it is written
+TMP_SUFFIX = ".tmp"
+
+# ===============================================
+# Define the Monitor Checkpoint
+# ===============================================
+
+# The snapshot is a directory containing the append-only shards, one per
+# saved snapshot:
+#   shard-k.json        the indices and named entities of the articles
+#                       processed since the previous snapshot, and the
+#                       events that became past since the previous snapshot
+#   embeddings-k.npy    the content embeddings of the shard articles
+#   centroids-k.npy     the centroids of the shard past events
+# and the state replaced by every snapshot:
+#   state.json          the input offset, the number of shards and the
+#                       active events
+#   active-k.npy        the centroids of the active events
+# The articles are referenced by their index in the (flattened) input list,
+# so the snapshot is only valid for the same input in the same order. The
+# articles are expected to be processed in the input order, i.e. only the
+# articles after the last stored one are new.
+
+
+def has_checkpoint(path: str) -> bool:
+    """Checks if the snapshot exists
+    Args:
+        path (str): The snapshot directory.
+    Returns:
+        exists (bool): If the snapshot can be restored.
+    """
+    return os.path.isfile(os.path.join(path, STATE_FILE))
+
+
+def remove_checkpoint(path: str) -> None:
+    """Removes the snapshot and all of its shards"""
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def read_state(path: str) -> dict:
+    """Reads the state of the last snapshot"""
+    with open(os.path.join(path, STATE_FILE), mode="r") as file:
+        return json.load(file)
+
+
+def write_json(file_path: str, value: dict) -> None:
+    """Writes the value into the json file"""
+    with open(file_path, mode="w", encoding="utf8") as file:
+        json.dump(value, file)
+
+
+def save_array(file_path: str, tensors: List[torch.Tensor]) -> None:
+    """Writes the stacked tensors into the numpy file"""
+    array = (
+        torch.stack(tensors).cpu().numpy().astype(np.float32)
+        if tensors
+        else np.zeros((0, 0), dtype=np.float32)
+    )
+    np.save(file_path, array)
+
+
+def get_event_state(event: NewsEvent, article_ids: Dict[int, int]) -> dict:
+    """Gets the serializable values of the event"""
+    return {
+        "articles": [article_ids[id(a)] for a in event.articles],
+        "time_interval": event.time_interval,
+        "time_sum": event.time_sum,
+        "c_norm": float(event.c_norm),
+        "use_ne": event.use_ne,
+        "named_entities": sorted(event.named_entities) if event.use_ne else None,
+    }
+
+
+def create_event(
+    event_state: dict, articles: List[NewsArticle], centroid: np.ndarray
+) -> NewsEvent:
+    """Restores the event from its serialized values"""
+    event = NewsEvent(articles=[], use_ne=event_state["use_ne"])
+    event.articles = [articles[idx] for idx in event_state["articles"]]
+    # update the event values
+    event.time_interval = event_state["time_interval"]
+    event.time_sum = event_state["time_sum"]
+    event.centroid = torch.from_numpy(np.asarray(centroid))
+    event.c_norm = event_state["c_norm"]
+    if event_state["use_ne"]:
+        event.named_entities = set(tuple(ne) for ne in event_state["named_entities"])
+    return event
+
+
+def save_checkpoint(
+    path: str,
+    articles: List[NewsArticle],
+    past_events: List[NewsEvent],
+    active_events: List[NewsEvent],
+    offset: int,
+) -> None:
+    """Writes the monitor snapshot
+
+    Only the embeddings of the articles processed since the previous
+    snapshot and the events that became past since then are appended as a
+    new shard; the active events are rewritten. The state is replaced last,
+    so a crash never leaves a partial snapshot.
+
+    Args:
+        path (str): The snapshot directory.
+        articles (List[NewsArticle]): The (flattened) input articles.
+        past_events (List[NewsEvent]): The past events of the monitor.
+        active_events (List[NewsEvent]): The active events of the monitor.
+        offset (int): The number of processed input items.
+    """
+    os.makedirs(path, exist_ok=True)
+    state = (
+        read_state(path)
+        if has_checkpoint(path)
+        else {"n_shards": 0, "n_stored": 0, "n_past_events": 0}
+    )
+    shard_id = state["n_shards"]
+    article_ids = {id(article): idx for idx, article in enumerate(articles)}
+
+    # the new articles are referenced by the active or the new past events
+    new_past_events = past_events[state["n_past_events"] :]
+    indices = sorted(
+        article_ids[id(article)]
+        for event in new_past_events + active_events
+        for article in event.articles
+        if article_ids[id(article)] >= state["n_stored"]
+    )
+    shard = {
+        "articles": indices,
+        "article_entities": {
+            idx: sorted(articles[idx].named_entities)
+            for idx in indices
+            if articles[idx].named_entities
+        },
+        "past_events": [get_event_state(e, article_ids) for e in new_past_events],
+    }
+
+    # write the new shard (a leftover of an unfinished snapshot is replaced)
+    save_array(
+        os.path.join(path, EMBEDDINGS_FILE.format(shard_id)),
+        [articles[idx].get_content_embedding() for idx in indices],
+    )
+    save_array(
+        os.path.join(path, CENTROIDS_FILE.format(shard_id)),
+        [event.centroid for event in new_past_events],
+    )
+    write_json(os.path.join(path, SHARD_FILE.format(shard_id)), shard)
+    save_array(
+        os.path.join(path, ACTIVE_CENTROIDS_FILE.format(shard_id)),
+        [event.centroid for event in active_events],
+    )
+
+    # replace the previous state
+    state_path = os.path.join(path, STATE_FILE)
+    write_json(
+        state_path + TMP_SUFFIX,
+        {
+            "offset": offset,
+            "n_articles": len(articles),
+            "n_shards": shard_id + 1,
+            "n_stored": max(indices[-1] + 1 if indices else 0, state["n_stored"]),
+            "n_past_events": len(past_events),
+            "active_events": [get_event_state(e, article_ids) for e in active_events],
+        },
+    )
+    os.replace(state_path + TMP_SUFFIX, state_path)
+    if shard_id > 0:
+        # the active events of the previous snapshot are not needed anymore
+        os.remove(os.path.join(path, ACTIVE_CENTROIDS_FILE.format(shard_id - 1)))
+
+
+def load_checkpoint(
+    path: str, articles: List[NewsArticle]
+) -> Tuple[List[NewsEvent], List[NewsEvent], int]:
+    """Restores the monitor snapshot
+
+    The embeddings are memory-mapped and assigned to the referenced
+    articles, so they do not need to be embedded again.
+
+    Args:
+        path (str): The snapshot directory.
+        articles (List[NewsArticle]): The (flattened) input articles.
+    Returns:
+        past_events (List[NewsEvent]): The restored past events.
+        active_events (List[NewsEvent]): The restored active events in the
+            order of their creation.
+        offset (int): The number of processed input items.
+    """
+    if not has_checkpoint(path):
+        raise Exception(f"Unsupported checkpoint path: {path}")
+
+    state = read_state(path)
+    if state["n_articles"] != len(articles):
+        raise Exception("The checkpoint does not match the input articles")
+
+    past_events = []
+    for shard_id in range(state["n_shards"]):
+        with open(os.path.join(path, SHARD_FILE.format(shard_id)), mode="r") as file:
+            shard = json.load(file)
+        # memory-map the embeddings (copy-on-write, the file is never modified)
+        embeddings = np.load(
+            os.path.join(path, EMBEDDINGS_FILE.format(shard_id)), mmap_mode="c"
+        )
+        centroids = np.load(
+            os.path.join(path, CENTROIDS_FILE.format(shard_id)), mmap_mode="c"
+        )
+
+        # restore the article representations
+        for row, idx in enumerate(shard["articles"]):
+            embedding = torch.from_numpy(np.asarray(embeddings[row]))
+            articles[idx].content_embedding = embedding
+        for idx, entities in shard["article_entities"].items():
+            articles[int(idx)].named_entities = set(tuple(ne) for ne in entities)
+
+        for row, event_state in enumerate(shard["past_events"]):
+            past_events.append(create_event(event_state, articles, centroids[row]))
+
+    centroids = np.load(
+        os.path.join(path, ACTIVE_CENTROIDS_FILE.format(state["n_shards"] - 1)),
+        mmap_mode="c",
+    )
+    active_events = [
+        create_event(event_state, articles, centroids[row])
+        for row, event_state in enumerate(state["active_events"])
+    ]
+    return past_events, active_events, state["offset"]
@@ -1,7 +1,10 @@
 import torch
 from src.utils.NewsEvent import NewsEvent
+from src.utils.NewsArticle import NewsArticle
 from src.utils.Wasserstein import Wasserstein
-from src.utils.LinearAlgebra import cosine_similarity
+from src.utils.CentroidIndex import CentroidIndex, create_centroid_index
+from src.utils.ExpirationQueue import ExpirationQueue
+from src.utils.MonitorCheckpoint import save_checkpoint, load_checkpoint
 from typing import List
 
 # ===============================================
@@ -17,13 +20,15 @@ ONE_DAY = 86400
 
 
 class MultiNewsEventMonitor:
-    active_events: List[NewsEvent]
     past_events: List[NewsEvent]
+    expiration_queue: ExpirationQueue
+    centroid_index: CentroidIndex
     sim_th: float
     time_th: float
     time_compare: str
     filter_cls: bool
     filter_cls_n: int
+    filter_cls_min_sim: float
     device: torch.device
 
     def __init__(
@@ -32,17 +37,31 @@ class MultiNewsEventMonitor:
         time_th_in_days: float,
         w_reg: float = 0.1,
         w_nit: int = 100,
-        filter_cls: bool = False,
+        w_tol: float = 1e-6,
+        w_batch_size: int = 64,
+        w_block_size: int = 1024,
+        filter_cls: bool = True,
         filter_cls_n: int = 100,
+        filter_cls_min_sim: float = None,
         device: torch.device = torch.device("cpu"),
+        index_backend: str = "exact",
+        index_params: dict = None,
     ) -> None:
-        self.active_events = []
+        self._active_events = {}
         self.past_events = []
+        self.expiration_queue = ExpirationQueue(lambda event: event.min_time)
+        self.centroid_index = create_centroid_index(
+            index_backend, **(index_params or {})
+        )
         self.sim_th = sim_th
         self.time_th = time_th_in_days * ONE_DAY
-        self.wasserstein = Wasserstein(reg=w_reg, nit=w_nit, device=device)
+        self.wasserstein = Wasserstein(
+            reg=w_reg, nit=w_nit, tol=w_tol, block_size=w_block_size, device=device
+        )
+        self.w_batch_size = w_batch_size
         self.filter_cls = filter_cls
         self.filter_cls_n = filter_cls_n
+        self.filter_cls_min_sim = filter_cls_min_sim
 
     # ==================================
     # Default Override Methods
@@ -53,39 +72,36 @@ class MultiNewsEventMonitor:
     # ==================================
 
     def update(self, mono_event: NewsEvent):
-        if len(self.active_events) == 0:
+        if len(self._active_events) == 0:
             # create a new news event cluster
-            self.active_events.append(mono_event)
+            self.__add_active_event(mono_event)
             return
 
         viewed_active_events = self.active_events
         if self.filter_cls:
             # filter based on most similar centroids
-            tmp_s = torch.Tensor(
-                [
-                    cosine_similarity(event.centroid, mono_event.centroid)
-                    for event in self.active_events
-                ]
+            _, viewed_active_events = self.centroid_index.search(
+                mono_event.centroid,
+                k=self.filter_cls_n,
+                threshold=self.filter_cls_min_sim,
             )
-            # update the viewed active events
-            sort_index = torch.argsort(tmp_s, descending=True)
-            viewed_active_events = [
-                viewed_active_events[idx] for idx in sort_index[: self.filter_cls_n]
-            ]
+
+        if len(viewed_active_events) == 0:
+            # no event is similar enough to be compared
+            self.__add_active_event(mono_event)
+            self.__update_past_events(mono_event.min_time)
+            return
 
         # calculate the similarity of the monolingual events
-        sims = []
-        for multi_event in viewed_active_events:
-            # calculate using wasserstein distance
-            mo_emb = mono_event.get_article_embeddings(type="content")
-            me_emb = multi_event.get_article_embeddings(type="content")
-            C = self.wasserstein.get_cost_matrix(me_emb, mo_emb)
-            me_dist = self.wasserstein.get_distributions(torch.ones(me_emb.shape[:2]))
-            mo_dist = self.wasserstein.get_distributions(torch.ones(mo_emb.shape[:2]))
-            sim, _, _ = self.wasserstein(C, me_dist, mo_dist, as_prob=True)
-            sims.append(sim)
-
-        sims = torch.Tensor(sims)
+        # using the wasserstein distance solved in padded batches
+        # (the transport matrices are not materialized)
+        sims = self.wasserstein.batch_distances(
+            [event.get_article_embeddings()[0] for event in viewed_active_events],
+            mono_event.get_article_embeddings()[0],
+            as_prob=True,
+            max_batch=self.w_batch_size,
+        )
+
         # get the sorted indices of the most similar events
         sort_index = torch.argsort(sims, descending=True)
 
@@ -102,7 +118,8 @@ class MultiNewsEventMonitor:
             )
             if time_diff <= self.time_th:
                 # add the article to the event and update the values
-                multi_event.add_articles(mono_event.articles)
+                multi_event.merge(mono_event)
+                self.expiration_queue.touch(multi_event)
                 assigned_to_event = True
                 # TODO: merge and split the events
                 break
@@ -116,16 +133,58 @@ class MultiNewsEventMonitor:
 
         if not assigned_to_event:
             # create a new news event cluster
-            self.active_events.append(mono_event)
+            self.__add_active_event(mono_event)
 
         # remove events that are old
         self.__update_past_events(mono_event.min_time)
 
+    @property
+    def active_events(self) -> List[NewsEvent]:
+        """Get the active events in the order of their creation"""
+        return list(self._active_events.values())
+
     @property
     def events(self):
         """Get all of the events"""
         return self.past_events + self.active_events
 
+    # ==================================
+    # Add Methods
+    # ==================================
+
+    def __add_active_event(self, event: NewsEvent):
+        """Adds the event to the active events"""
+        self._active_events[id(event)] = event
+        self.expiration_queue.push(event)
+        self.centroid_index.add(event)
+
+    # ==================================
+    # Checkpoint Methods
+    # ==================================
+
+    def save_checkpoint(self, path: str, articles: List[NewsArticle], offset: int):
+        """Writes the monitor snapshot
+        Args:
+            path (str): The snapshot directory.
+            articles (List[NewsArticle]): The (flattened) input articles.
+            offset (int): The number of processed input items.
+        """
+        save_checkpoint(path, articles, self.past_events, self.active_events, offset)
+
+    def load_checkpoint(self, path: str, articles: List[NewsArticle]) -> int:
+        """Restores the monitor snapshot
+        Args:
+            path (str): The snapshot directory.
+            articles (List[NewsArticle]): The (flattened) input articles.
+        Returns:
+            offset (int): The number of processed input items.
+        """
+        past_events, active_events, offset = load_checkpoint(path, articles)
+        self.past_events = past_events
+        for event in active_events:
+            self.__add_active_event(event)
+        return offset
+
     # ==================================
     # Remove Methods
     # ==================================
@@ -134,13 +193,12 @@ class MultiNewsEventMonitor:
 
     def __update_past_events(self, time):
         """Update the past events"""
-        for event_id in reversed(range(len(self.active_events))):
-            event = self.active_events[event_id]
-            if self.time_th <= self.__absolute_difference(time, event.min_time):
-                # add the event to the past events
-                self.past_events.append(event)
-                # remove the event from the active events
-                del self.active_events[event_id]
+        for event in self.expiration_queue.pop_expired(time, self.time_th):
+            # add the event to the past events
+            self.past_events.append(event)
+            # remove the event from the active events
+            del self._active_events[id(event)]
+            self.centroid_index.remove(event)
 
     # ==================================
     # Evaluation Methods
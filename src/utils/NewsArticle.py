@@ -3,11 +3,11 @@ import re
 import torch
 import pathlib
 import datetime
-from typing import Set, Tuple, List, Union
+from typing import Set, Tuple, List, Union, Optional
 
 # import models
-from src.models.MultilingualLM import MultilingualLM
-from src.models.MultilingualNER import MultilingualNER
+from src.models.ModelRegistry import registry, get_embed_model_id
+from src.utils.EmbeddingStore import EmbeddingStore
 
 MODELS_PATH = os.path.join(
     pathlib.Path(__file__).parent.parent.parent.absolute(), "models"
@@ -21,17 +21,39 @@ MODELS_PATH = os.path.join(
 regex_whitespace = re.compile(r"(\s){1,}", re.IGNORECASE)
 format_string = lambda x: re.sub(regex_whitespace, " ", x).strip()
 
+
+def format_named_entities(ner_results: List[dict]) -> Set[Tuple[str, str]]:
+    """Converts the NER results into the (entity, entity type) tuples"""
+    return set([(ne["word"], ne["entity_group"]) for ne in ner_results])
+
+
 # ===============================================
 # Initialize Models
 # ===============================================
 
-# initialize LM
-embed_model = MultilingualLM(
-    model_type="sbert", pooling_type="mean", use_gpu=True
-).eval()
+# the LM ("embed") and NER ("ner") models are loaded from the
+# registry on first use; use registry.set to inject other instances
+
+# the persistent content embedding store (disabled by default)
+embedding_store = None
+
+
+def set_embedding_store(path: Optional[str]) -> Optional[EmbeddingStore]:
+    """Sets the persistent store consulted for the content embeddings
+    Args:
+        path (str): The directory of the embedding store. If None, the
+            store is disabled.
+    Returns:
+        store (Optional[EmbeddingStore]): The embedding store.
+    """
+    global embedding_store
+    if embedding_store is not None:
+        embedding_store.flush()
+    embedding_store = (
+        EmbeddingStore(path, model_id=get_embed_model_id()) if path else None
+    )
+    return embedding_store
 
-# initialize NER
-ner_model = MultilingualNER(use_gpu=True).eval()
 
 # ===============================================
 # Define new Types
@@ -93,6 +115,7 @@ class NewsArticle:
     concepts: str
     cluster_id: str
     content_embedding: Optional[torch.Tensor]
+    pair_embedding: Optional[torch.Tensor]
 
     # format="%Y-%m-%dT%H:%M:%SZ"
     def __init__(self, article: Article) -> None:
@@ -118,6 +141,7 @@ class NewsArticle:
 
         # representation placeholders
         self.content_embedding = None
+        self.pair_embedding = None
         self.named_entities = (
             set(article["namedEntities"])
             if "namedEntities" in article and article["namedEntities"] is not None
@@ -202,8 +226,16 @@ class NewsArticle:
             # embedding is already available
             return self.content_embedding
 
+        if embedding_store is not None:
+            # get the content representation from the store
+            self.content_embedding = embedding_store.get(self.get_text())
+            if torch.is_tensor(self.content_embedding):
+                return self.content_embedding
+
         # get the content representation
-        self.content_embedding = embed_model(self.get_text())[0]
+        self.content_embedding = registry.get("embed")(self.get_text())[0]
+        if embedding_store is not None:
+            embedding_store.put(self.get_text(), self.content_embedding)
         # return the content embedding
         return self.content_embedding
 
@@ -214,15 +246,13 @@ class NewsArticle:
                 tuples, where the first element of the tuple is the named
                 entity and the second is the entity type.
         """
-        if self.named_entities:
+        if self.named_entities is not None:
             # entities are already available
             return self.named_entities
 
         # get the articles named entities
-        self.named_entities = ner_model(self.get_text())
-        self.named_entities = set(
-            [(ne["word"], ne["entity_group"]) for ne in self.named_entities]
-        )
+        ner_results = registry.get("ner")(self.get_text())
+        self.named_entities = format_named_entities(ner_results)
         return self.named_entities
 
     def get_wiki_concepts(self):
@@ -254,3 +284,58 @@ class NewsArticle:
                 was published.
         """
         return datetime.datetime.fromtimestamp(self.time)
+
+
+# ===============================================
+# Bulk Methods
+# ===============================================
+
+
+def embed_articles(
+    articles: List[NewsArticle],
+    batch_size: int = 32,
+    token_budget: Optional[int] = None,
+) -> None:
+    """Fills the content embeddings of the articles in length-bucketed batches
+    Args:
+        articles (List[NewsArticle]): The articles to be embedded. Articles
+            that already have the content embedding are skipped.
+        batch_size (int): The maximum number of articles in a batch.
+        token_budget (int): The maximum number of padded tokens in a batch.
+    """
+    articles = [a for a in articles if not torch.is_tensor(a.content_embedding)]
+    if embedding_store is not None:
+        # get the content representations from the store
+        for article in articles:
+            article.content_embedding = embedding_store.get(article.get_text())
+        articles = [a for a in articles if not torch.is_tensor(a.content_embedding)]
+    if len(articles) == 0:
+        return
+
+    embeds = registry.get("embed").embed_batch(
+        [a.get_text() for a in articles],
+        batch_size=batch_size,
+        token_budget=token_budget,
+    )
+    for article, embed in zip(articles, embeds):
+        article.content_embedding = embed
+        if embedding_store is not None:
+            embedding_store.put(article.get_text(), embed)
+
+
+def extract_named_entities(articles: List[NewsArticle], batch_size: int = 16) -> None:
+    """Fills the named entities of the articles in batches
+    Args:
+        articles (List[NewsArticle]): The articles. Articles that already
+            have the named entities are skipped.
+        batch_size (int): The number of text windows in a batch.
+    """
+    articles = [a for a in articles if a.named_entities is None]
+    if len(articles) == 0:
+        return
+
+    ner_results = registry.get("ner").extract_batch(
+        [a.get_text() for a in articles], batch_size=batch_size
+    )
+    for article, results in zip(articles, ner_results):
+        article.named_entities = format_named_entities(results)
@@ -1,9 +1,10 @@
-import operator
-from functools import reduce
+import torch
 from src.utils.LinearAlgebra import (
     get_intra_distances,
     get_centroid,
     update_centroid,
+    update_centroid_bulk,
+    merge_centroids,
 )
 
 from src.utils.NewsEventBase import NewsEventBase
@@ -19,7 +20,8 @@ class NewsEvent(NewsEventBase):
         self.use_ne = use_ne
         self.centroid = None
         self.c_norm = None
-        self.time_interval = None
+        # the centroid indices containing the event
+        self.centroid_indices = []
         # update the event properties
         self._init_centroid()
         if self.use_ne:
@@ -38,9 +40,23 @@ class NewsEvent(NewsEventBase):
             self._update_named_entities()
 
     def add_articles(self, articles):
-        # append the articles
-        for article in articles:
-            self.add_article(article)
+        if len(articles) == 0:
+            return
+        n_articles = len(self.articles)
+        super().add_articles(articles)
+
+        # update the event values
+        a_embeds = [a.get_content_embedding() for a in articles]
+        if n_articles == 0:
+            self.centroid, self.c_norm = get_centroid(a_embeds)
+        else:
+            self.centroid, self.c_norm = update_centroid_bulk(
+                self.centroid, self.c_norm, n_articles, torch.stack(a_embeds)
+            )
+        self._update_centroid_indices()
+        if self.use_ne:
+            for article in articles:
+                self.named_entities |= article.get_named_entities()
 
     def get_intra_distances(self):
         a_embeds = [a.get_content_embedding() for a in self.articles]
@@ -69,7 +85,7 @@ class NewsEvent(NewsEventBase):
             return
         # get the article named entities
         ne = [a.get_named_entities() for a in self.articles]
-        self.named_entities = reduce(operator.or_, ne)
+        self.named_entities = set().union(*ne)
 
     # ==================================
     # Update Methods
@@ -91,6 +107,12 @@ class NewsEvent(NewsEventBase):
             self.centroid, self.c_norm = update_centroid(
                 self.centroid, self.c_norm, n_articles, a_embed
             )
+        self._update_centroid_indices()
+
+    def _update_centroid_indices(self):
+        # update the centroid in the indices
+        for index in self.centroid_indices:
+            index.update(self)
 
     def _update_named_entities(self):
         if len(self.articles) == 0:
@@ -98,8 +120,43 @@ class NewsEvent(NewsEventBase):
             self.named_entities = set()
         elif len(self.articles) == 1:
             # there is only one article to extract named entities from
-            self.named_entities = self.articles[0].get_named_entities()
+            self.named_entities = set(self.articles[0].get_named_entities())
         else:
             # append the latest named entities to the cluster
-            ne = self.articles[-1].get_named_entities()
-            self.named_entities = self.named_entities | ne
+            self.named_entities |= self.articles[-1].get_named_entities()
+
+    # ==================================
+    # Merge Methods
+    # ==================================
+
+    def merge(self, event):
+        """Merges the other event into the event
+        The centroids are combined using their norms and article counts, and
+        the time intervals and named entities are merged in place.
+        Args:
+            event (NewsEvent): The event to be merged.
+        """
+        if len(event.articles) == 0:
+            return
+        n_articles = len(self.articles)
+        super().merge(event)
+
+        # update the event values
+        if n_articles == 0:
+            self.centroid, self.c_norm = event.centroid.clone(), event.c_norm
+        else:
+            self.centroid, self.c_norm = merge_centroids(
+                self.centroid,
+                self.c_norm,
+                n_articles,
+                event.centroid,
+                event.c_norm,
+                len(event.articles),
+            )
+        self._update_centroid_indices()
+        if self.use_ne:
+            if event.use_ne:
+                self.named_entities |= event.named_entities
+            else:
+                for article in event.articles:
+                    self.named_entities |= article.get_named_entities()
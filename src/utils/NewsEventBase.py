@@ -2,7 +2,6 @@ import torch
 from src.utils.LinearAlgebra import (
     get_min,
     get_max,
-    get_avg,
 )
 
 
@@ -13,6 +12,9 @@ class NewsEventBase:
         # initialize the event properties
         self.articles = articles
         self.time_interval = None
+        self.time_sum = 0
+        # the article embedding buffer (allocated on first use)
+        self.embeddings = None
 
         # update the event properties
         self._init_time_interval()
@@ -53,18 +55,26 @@ class NewsEventBase:
         self.articles.append(article)
 
         # update the event values
-        self._update_time_interval()
+        self._update_time_interval([article])
+        self._update_embeddings([article])
 
     def add_articles(self, articles):
         self.articles.extend(articles)
 
         # update the event values
-        self._update_time_interval()
+        self._update_time_interval(articles)
+        self._update_embeddings(articles)
 
     def get_article_embeddings(self):
-        return torch.stack(
-            [article.get_content_embedding() for article in self.articles]
-        ).unsqueeze(0)
+        """Gets the article embeddings
+        Returns:
+            embeddings (torch.Tensor): The (1, n_articles, dim) view of the
+                event embedding buffer. The view is valid until the next
+                articles are added to the event.
+        """
+        if self.embeddings is None:
+            self._init_embeddings()
+        return self.embeddings[: len(self.articles)].unsqueeze(0)
 
     def get_time(self, metric="avg"):
         if len(self.articles) == 0:
@@ -79,33 +89,110 @@ class NewsEventBase:
         if len(self.articles) == 0:
             # there are no articles
             self.time_interval = None
+            self.time_sum = 0
             return
         # get the article times
         times = [a.time for a in self.articles]
+        self.time_sum = sum(times)
         self.time_interval = {
             "min": get_min(times),
-            "avg": get_avg(times),
+            "avg": self.time_sum / len(times),
             "max": get_max(times),
         }
 
+    def _init_embeddings(self):
+        if len(self.articles) == 0:
+            # there are no articles
+            return
+        embeds = torch.stack([a.get_content_embedding() for a in self.articles])
+        # preallocate the buffer for the following articles
+        self.embeddings = embeds.new_empty((2 * embeds.shape[0], embeds.shape[1]))
+        self.embeddings[: embeds.shape[0]] = embeds
+
     # ==================================
     # Update Methods
     # ==================================
 
-    def _update_time_interval(self):
-        if len(self.articles) != 0:
-            times = [a.time for a in self.articles]
+    def _update_time_interval(self, articles):
+        """Updates the time interval with the newly added articles
+        Args:
+            articles (List[NewsArticle]): The articles appended to the event.
+        """
+        if len(articles) == 0:
+            return
+        times = [a.time for a in articles]
+        if self.time_interval is None:
+            # the first articles of the event
             self.time_interval = {
                 "min": get_min(times),
-                "avg": get_avg(times),
+                "avg": None,
                 "max": get_max(times),
             }
+        else:
+            self.time_interval["min"] = min(self.time_interval["min"], get_min(times))
+            self.time_interval["max"] = max(self.time_interval["max"], get_max(times))
+        # keep the running sum in the order of the articles
+        for time in times:
+            self.time_sum += time
+        self.time_interval["avg"] = self.time_sum / len(self.articles)
+
+    def _update_embeddings(self, articles, embeds=None):
+        """Appends the embeddings of the newly added articles to the buffer
+        Args:
+            articles (List[NewsArticle]): The articles appended to the event.
+            embeds (torch.Tensor): The (len(articles), dim) embeddings of the
+                articles. If None, they are taken from the articles.
+        """
+        if self.embeddings is None or len(articles) == 0:
+            # the buffer is allocated on first use
+            return
+        if embeds is None:
+            embeds = torch.stack([a.get_content_embedding() for a in articles])
+
+        n_articles = len(self.articles)
+        if n_articles > self.embeddings.shape[0]:
+            # double the buffer capacity
+            capacity = max(2 * self.embeddings.shape[0], n_articles)
+            buffer = self.embeddings.new_empty((capacity, self.embeddings.shape[1]))
+            buffer[: n_articles - len(articles)] = self.embeddings[
+                : n_articles - len(articles)
+            ]
+            self.embeddings = buffer
+        self.embeddings[n_articles - len(articles) : n_articles] = embeds
 
     # ==================================
     # Merge Methods
     # ==================================
 
-    # TODO: implement merge methods
+    def merge(self, event):
+        """Merges the articles of the other event into the event
+        Args:
+            event (NewsEventBase): The event to be merged.
+        """
+        self.articles.extend(event.articles)
+
+        # update the event values
+        self._merge_time_interval(event)
+        self._update_embeddings(
+            event.articles,
+            event.get_article_embeddings()[0] if self.embeddings is not None else None,
+        )
+
+    def _merge_time_interval(self, event):
+        """Merges the time interval of the other event in constant time"""
+        if event.time_interval is None:
+            return
+        if self.time_interval is None:
+            self.time_interval = {**event.time_interval}
+        else:
+            self.time_interval["min"] = min(
+                self.time_interval["min"], event.time_interval["min"]
+            )
+            self.time_interval["max"] = max(
+                self.time_interval["max"], event.time_interval["max"]
+            )
+        self.time_sum += event.time_sum
+        self.time_interval["avg"] = self.time_sum / len(self.articles)
 
     # ==================================
     # Split Methods
@@ -2,9 +2,12 @@ import torch
 from src.models.PairBERT import PairBERT
 from src.utils.NewsEvent import NewsEvent
 from src.utils.NewsArticle import NewsArticle
-from src.utils.LinearAlgebra import cosine_similarity, jaccard_index
+from src.utils.CentroidIndex import CentroidIndex, create_centroid_index
+from src.utils.ExpirationQueue import ExpirationQueue
+from src.utils.MonitorCheckpoint import save_checkpoint, load_checkpoint
+from src.utils.LinearAlgebra import jaccard_index
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 # ===============================================
 # Define constants
@@ -19,8 +22,9 @@ ONE_DAY = 86400
 
 
 class NewsEventMonitor:
-    active_events: List[NewsEvent]
     past_events: List[NewsEvent]
+    expiration_queue: ExpirationQueue
+    lang_indices: Dict[str, CentroidIndex]
     sim_threshold: float
     time_threshold: int
     time_compare: str
@@ -34,15 +38,27 @@ class NewsEventMonitor:
         compare_threshold: float = 0.7,
         compare_model: PairBERT = None,
         compare_ne: bool = True,
+        compare_select: str = "best",
+        is_multilingual: bool = False,
+        index_backend: str = "exact",
+        index_params: dict = None,
     ) -> None:
-        self.active_events = []
+        self._active_events = {}
         self.past_events = []
+        self.lang_indices = {}
         self.sim_threshold = sim_threshold
         self.time_threshold = time_threshold_in_days * ONE_DAY
         self.time_compare = time_compare_stat
+        self.expiration_queue = ExpirationQueue(
+            lambda event: event.time_interval[self.time_compare]
+        )
         self.compare_named_entities = compare_ne
         self.compare_threshold = compare_threshold
         self.compare_model = compare_model
+        self.compare_select = compare_select
+        self.is_multilingual = is_multilingual
+        self.index_backend = index_backend
+        self.index_params = index_params or {}
 
     # ==================================
     # Default Override Methods
@@ -53,35 +69,34 @@ class NewsEventMonitor:
     # ==================================
 
     def update(self, article: NewsArticle, device=None):
-        """Update the events with the new article"""
+        """Update the events with the new article
+
+        The candidate events are verified with the compare model embeddings.
+        The embeddings of the event representatives (the first event
+        articles) are cached on the CPU, so each of them is encoded only once. With compare_select="best"
+        the article is assigned to the passing event with the highest compare
+        score, and with compare_select="first" to the first passing event in
+        the order of the centroid similarity.
+        """
 
-        # get the events of the specific language
-        lang_active_events = [
-            event for event in self.active_events if event.lang == article.lang
-        ]
+        # get the centroid index of the specific language
+        lang_index = self.lang_indices.get(self.__get_index_lang(article.lang))
 
-        if len(lang_active_events) == 0:
+        if lang_index is None or len(lang_index) == 0:
             # create a new news event cluster
             event = NewsEvent(articles=[article], use_ne=self.compare_named_entities)
-            self.active_events.append(event)
+            self.__add_active_event(event)
             return
 
-        # calculate the similarity of the article to the events
-        sims = torch.Tensor(
-            [
-                cosine_similarity(event.centroid, article.get_content_embedding())
-                for event in lang_active_events
-            ]
+        # get the events with the similarity above the threshold
+        # sorted from the most to the least similar
+        _, candidates = lang_index.search(
+            article.get_content_embedding(), threshold=self.sim_threshold
         )
-        # get the sorted indices of the most similar events
-        sort_index = torch.argsort(sims, descending=True)
-
-        idx = 0
-        assigned_to_event = False
-        while sims[sort_index[idx]] > self.sim_threshold:
-            # get the next closest news event
-            event = lang_active_events[sort_index[idx]]
 
+        # filter the candidates with the time and entity constraints
+        verify_events = []
+        for event in candidates:
             # check if the article happened at an approximate
             # same time as the rest of the event articles
             time_diff = self.__absolute_difference(
@@ -97,41 +112,90 @@ class NewsEventMonitor:
                 else True
             )
 
-            # classify if the article is similar enough to the event
-            compare_score = self.compare_model(
-                [article.get_text()], [event.articles[0].get_text()], device
+            if has_similar_entities and time_diff <= self.time_threshold:
+                verify_events.append(event)
+
+        assigned_to_event = False
+        article_embed = None
+        if len(verify_events) > 0:
+            # classify if the article is similar enough to the events
+            article_embed, event_embeds = self.__encode_articles(
+                article, [event.articles[0] for event in verify_events], device
             )
-            if (
-                has_similar_entities
-                and compare_score > self.compare_threshold
-                and time_diff <= self.time_threshold
-            ):
+            compare_scores = self.compare_model.score_embeddings(
+                article_embed, event_embeds
+            )
+            event = self.__select_event(verify_events, compare_scores)
+            if event is not None:
                 # add the article to the event and update the values
                 event.add_article(article)
+                self.expiration_queue.touch(event)
                 assigned_to_event = True
                 # TODO: merge and split the events
-                break
-
-            if len(sims) == idx + 1:
-                # there are no more events to check
-                break
-
-            # go to the next closest event
-            idx += 1
 
         if not assigned_to_event:
+            if article_embed is not None:
+                # the article is the representative of the new event
+                article.pair_embedding = article_embed[0].to("cpu", copy=True)
             # create a new news event cluster
             event = NewsEvent(articles=[article], use_ne=self.compare_named_entities)
-            self.active_events.append(event)
+            self.__add_active_event(event)
 
         # remove events that are old
         self.__update_past_events(article.time)
 
+    @property
+    def active_events(self) -> List[NewsEvent]:
+        """Get the active events in the order of their creation"""
+        return list(self._active_events.values())
+
     @property
     def events(self):
         """Get all of the events"""
         return self.past_events + self.active_events
 
+    # ==================================
+    # Add Methods
+    # ==================================
+
+    def __add_active_event(self, event: NewsEvent):
+        """Adds the event to the active events"""
+        self._active_events[id(event)] = event
+        self.expiration_queue.push(event)
+        lang = self.__get_index_lang(event.lang)
+        if lang not in self.lang_indices:
+            self.lang_indices[lang] = create_centroid_index(
+                self.index_backend, **self.index_params
+            )
+        self.lang_indices[lang].add(event)
+
+    # ==================================
+    # Checkpoint Methods
+    # ==================================
+
+    def save_checkpoint(self, path: str, articles: List[NewsArticle], offset: int):
+        """Writes the monitor snapshot
+        Args:
+            path (str): The snapshot directory.
+            articles (List[NewsArticle]): The (flattened) input articles.
+            offset (int): The number of processed input items.
+        """
+        save_checkpoint(path, articles, self.past_events, self.active_events, offset)
+
+    def load_checkpoint(self, path: str, articles: List[NewsArticle]) -> int:
+        """Restores the monitor snapshot
+        Args:
+            path (str): The snapshot directory.
+            articles (List[NewsArticle]): The (flattened) input articles.
+        Returns:
+            offset (int): The number of processed input items.
+        """
+        past_events, active_events, offset = load_checkpoint(path, articles)
+        self.past_events = past_events
+        for event in active_events:
+            self.__add_active_event(event)
+        return offset
+
     # ==================================
     # Statistics Methods
     # ==================================
@@ -148,15 +212,12 @@ class NewsEventMonitor:
     # TODO: implement remove methods
     def __update_past_events(self, time):
         """Update the past events"""
-        for event_id in reversed(range(len(self.active_events))):
-            event = self.active_events[event_id]
-            if self.time_threshold <= self.__absolute_difference(
-                time, event.time_interval[self.time_compare]
-            ):
-                # add the event to the past events
-                self.past_events.append(event)
-                # remove the event from the active events
-                del self.active_events[event_id]
+        for event in self.expiration_queue.pop_expired(time, self.time_threshold):
+            # add the event to the past events
+            self.past_events.append(event)
+            # remove the event from the active events
+            del self._active_events[id(event)]
+            self.lang_indices[self.__get_index_lang(event.lang)].remove(event)
 
     # ==================================
     # Merge Methods
@@ -206,6 +267,45 @@ class NewsEventMonitor:
         return j_index >= threshold
         # return len(e_entities & a_entities) >= threshold
 
+    def __encode_articles(
+        self,
+        article: NewsArticle,
+        representatives: List[NewsArticle],
+        device=None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Gets the compare model embeddings of the article and representatives
+
+        The article and the uncached representatives are encoded in a single
+        batch. Only the representative embeddings are cached, as CPU copies,
+        so the cache does not hold the device memory of the batches.
+        """
+        uncached = [a for a in representatives if a.pair_embedding is None]
+        embeds = self.compare_model.encode(
+            [a.get_text() for a in [article] + uncached], device
+        )
+        for representative, embed in zip(uncached, embeds[1:]):
+            representative.pair_embedding = embed.to("cpu", copy=True)
+        event_embeds = torch.stack([a.pair_embedding for a in representatives])
+        return embeds[:1], event_embeds.to(embeds.device)
+
+    def __select_event(
+        self, events: List[NewsEvent], compare_scores: torch.Tensor
+    ) -> Optional[NewsEvent]:
+        """Selects the event the article is assigned to"""
+        passing = (compare_scores > self.compare_threshold).nonzero().squeeze(1)
+        if len(passing) == 0:
+            return None
+        if self.compare_select == "first":
+            return events[passing[0].item()]
+        if self.compare_select == "best":
+            return events[passing[compare_scores[passing].argmax()].item()]
+        raise Exception(f"Unsupported compare select: {self.compare_select}")
+
+    def __get_index_lang(self, lang: str) -> str:
+        """Gets the language of the centroid index"""
+        # multilingual monitors compare articles across all languages
+        return "multilingual" if self.is_multilingual else lang
+
     def __absolute_difference(self, time1, time2):
         """ "Calculates the absolute difference between two times"""
         return abs(time1 - time2)
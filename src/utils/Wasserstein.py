@@ -1,20 +1,55 @@
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as f
 
+from typing import List
+
+# the largest cost to regularization ratio for which exp(-C/reg)
+# does not underflow in single precision
+MAX_EXP_RATIO = 80
+
 
 class Wasserstein(nn.Module):
-    def __init__(self, reg: float = 0.1, nit: int = 500, device=torch.device("cpu")):
+    def __init__(
+        self,
+        reg: float = 0.1,
+        nit: int = 500,
+        tol: float = 1e-6,
+        check_every: int = 10,
+        log_domain: bool = None,
+        block_size: int = 1024,
+        device=torch.device("cpu"),
+    ):
         """The wasserstein distance model.
 
         Args:
             reg: The regularization factor used with "emd" (Default: 0.1).
             nit: The maximum number of iterations used with "emd" (Default: 500).
+            tol: The tolerance of the marginal error used to stop the
+                iterations. If None, all nit iterations are run (Default: 1e-6).
+            check_every: The number of iterations between the marginal
+                error checks (Default: 10).
+            log_domain: If True, the stabilized log-domain iterations are used.
+                If None, they are used only when exp(-C/reg) would
+                underflow (Default: None).
+            block_size: The size of the cost matrix tiles used by the blocked
+                distance. Inputs with more than block_size^2 cost matrix
+                elements are compared with the blocked distance (Default: 1024).
         """
         super(Wasserstein, self).__init__()
         self.reg = reg
         self.nit = nit
+        self.tol = tol
+        self.check_every = check_every
+        self.log_domain = log_domain
+        self.block_size = block_size
         self.device = device
+        # the number of iterations used in the last sinkhorn call
+        self.n_iter = 0
+        # the number of sinkhorn calls and their total iterations
+        self.total_calls = 0
+        self.total_iter = 0
 
     def forward(
         self,
@@ -41,6 +76,173 @@ class Wasserstein(nn.Module):
         # return the loss, transport and cost matrices
         return dists, C, T
 
+    def distance(
+        self,
+        C: torch.Tensor,
+        dist_1: torch.Tensor,
+        dist_2: torch.Tensor,
+        as_prob: bool = False,
+    ) -> torch.Tensor:
+        """Calculate only the wasserstein distance.
+
+        The transport cost is calculated directly as u^T (K * C) v from the
+        sinkhorn scalings, without building the transport matrix. In the log
+        domain the cost is accumulated over the row blocks of the matrix.
+
+        Args:
+            C: The cost matrix.
+            dist_1: The distribution of the first input.
+            dist_2: The distribution of the second input.
+            as_prob: Return the distances as probabilities.
+
+        Returns:
+            torch.Tensor: The distances.
+        """
+        C = C.to(self.device)
+        if self.__use_log_domain(C, self.reg):
+            log_u, log_K, log_v = self.sinkhorn_log_scalings(
+                dist_1, dist_2, C, self.reg, self.nit
+            )
+            # accumulate the transport cost row block by row block, so the
+            # transport matrix is never kept in memory
+            dists = torch.zeros(C.shape[0], device=C.device)
+            for i in range(0, C.shape[1], self.block_size):
+                rows = slice(i, i + self.block_size)
+                log_T = log_u[:, rows].unsqueeze(2) + log_K[:, rows]
+                log_T = log_T + log_v.unsqueeze(1)
+                dists += (torch.exp(log_T) * C[:, rows]).sum(dim=(1, 2))
+        else:
+            u, K, v = self.sinkhorn_scalings(dist_1, dist_2, C, self.reg, self.nit)
+            KCv = (K * C).bmm(v.unsqueeze(2)).squeeze(2)
+            dists = (u * KCv).sum(dim=1)
+        dists = dists.cpu()
+
+        if as_prob:
+            dists = torch.exp(-(dists**2))
+        return dists
+
+    def blocked_distance(
+        self,
+        embeds_1: torch.Tensor,
+        embeds_2: torch.Tensor,
+        as_prob: bool = False,
+        block_size: int = None,
+    ) -> torch.Tensor:
+        """Calculate the wasserstein distance of two large inputs.
+
+        The cost matrix is never materialized: its tiles are recomputed from
+        the embeddings in every iteration and the log-domain sinkhorn
+        reductions are accumulated over the tiles. The peak memory is
+        bounded by the tile size.
+
+        Args:
+            embeds_1: The (n, dim) embeddings of the first input.
+            embeds_2: The (m, dim) embeddings of the second input.
+            as_prob: Return the distance as probability.
+            block_size: The number of rows and columns in a tile. If None,
+                self.block_size is used (Default: None).
+
+        Returns:
+            torch.Tensor: The distance between the inputs.
+        """
+        block_size = block_size or self.block_size
+        X = f.normalize(embeds_1.to(self.device), p=2, dim=1)
+        Y = f.normalize(embeds_2.to(self.device), p=2, dim=1)
+        # the uniform distributions of the inputs
+        log_dist_1 = torch.full((X.shape[0],), -math.log(X.shape[0]), device=X.device)
+        log_dist_2 = torch.full((Y.shape[0],), -math.log(Y.shape[0]), device=Y.device)
+        # initialize the log u and log v tensors
+        log_u = torch.zeros_like(log_dist_1)
+        log_v = torch.zeros_like(log_dist_2)
+        istep = 0
+        while istep < self.nit:
+            # calculate log(K.T * u) tile by tile
+            log_KTu = self.__blocked_logsumexp(X, Y, log_u, block_size, dim=0)
+            if self.__should_check(istep) and istep > 0:
+                # calculate the marginal error of the second distribution
+                marginal = torch.exp(log_v + log_KTu)
+                error = torch.linalg.vector_norm(marginal - log_dist_2.exp()).item()
+                if error < self.tol:
+                    break
+            # calculate the log v_{i} tensor
+            log_v = log_dist_2 - log_KTu
+            # calculate the log u_{i} tensor
+            log_u = log_dist_1 - self.__blocked_logsumexp(
+                X, Y, log_v, block_size, dim=1
+            )
+            # go to next step
+            istep = istep + 1
+        self.__log_iterations(istep)
+
+        # accumulate the transport cost tile by tile
+        dist = torch.zeros((), device=X.device)
+        for i, j, C in self.__cost_tiles(X, Y, block_size):
+            log_T = log_u[i].unsqueeze(1) - C / self.reg + log_v[j].unsqueeze(0)
+            dist += (torch.exp(log_T) * C).sum()
+        dist = dist.cpu()
+
+        if as_prob:
+            dist = torch.exp(-(dist**2))
+        return dist
+
+    def batch_distances(
+        self,
+        embeds_1: List[torch.Tensor],
+        embeds_2: torch.Tensor,
+        as_prob: bool = False,
+        max_batch: int = 64,
+        max_ratio: float = 2.0,
+    ) -> torch.Tensor:
+        """Calculate the wasserstein distances of multiple inputs to the same input.
+
+        The first inputs are sorted by size and grouped into buckets with
+        similar sizes. Inputs whose cost matrix exceeds the tile size are
+        compared with the blocked distance instead. The inputs of each bucket
+        are padded to the same length and all transport problems of the
+        bucket are solved with a single batched sinkhorn, where the padded
+        positions get zero mass.
+
+        Args:
+            embeds_1: The list of (n_i, dim) embeddings of the first inputs.
+            embeds_2: The (m, dim) embeddings of the second input.
+            as_prob: Return the distances as probabilities.
+            max_batch: The maximum number of inputs in a bucket (Default: 64).
+            max_ratio: The maximum ratio between the largest and smallest
+                input size in a bucket (Default: 2.0).
+
+        Returns:
+            torch.Tensor: The distances of the first inputs to the second input.
+        """
+        dists = torch.zeros(len(embeds_1))
+        n_elements = self.block_size**2
+        order = []
+        for idx, embeds in enumerate(embeds_1):
+            if embeds.shape[0] * embeds_2.shape[0] > n_elements:
+                # the cost matrix of large inputs is streamed in tiles
+                dists[idx] = self.blocked_distance(embeds, embeds_2, as_prob=as_prob)
+            else:
+                order.append(idx)
+        order = sorted(order, key=lambda i: embeds_1[i].shape[0])
+
+        for bucket in get_size_buckets(
+            [embeds_1[i].shape[0] for i in order], max_batch, max_ratio
+        ):
+            ids = [order[i] for i in bucket]
+            n_max = max(embeds_1[i].shape[0] for i in ids)
+            # pad the first embeddings and mask the padded positions
+            X = torch.zeros((len(ids), n_max, embeds_2.shape[1]))
+            mask = torch.zeros((len(ids), n_max))
+            for row, idx in enumerate(ids):
+                X[row, : embeds_1[idx].shape[0]] = embeds_1[idx]
+                mask[row, : embeds_1[idx].shape[0]] = 1
+            Y = embeds_2.unsqueeze(0).expand(len(ids), -1, -1)
+
+            C = self.get_cost_matrix(X, Y)
+            dist_1 = self.get_distributions(mask)
+            dist_2 = self.get_distributions(torch.ones(Y.shape[:2]))
+            dists[ids] = self.distance(C, dist_1, dist_2, as_prob=as_prob)
+        return dists
+
     def get_cost_matrix(self, embeds_1: torch.Tensor, embeds_2: torch.Tensor):
         """Calculates the cost matrix of the embeddings
 
@@ -86,6 +288,9 @@ class Wasserstein(nn.Module):
         The sinkhorn algorithm adapted for PyTorch from the
             PythonOT library <https://pythonot.github.io/>.
 
+        The iterations stop when the marginal error drops below the tolerance
+        and the number of used iterations is stored in self.n_iter.
+
         Args:
             dist_1: The distribution of the first input.
             dist_2: The distribution of the second input.
@@ -96,10 +301,41 @@ class Wasserstein(nn.Module):
         Returns:
             torch.Tensor: The transportation matrix.
 
+        """
+        if self.__use_log_domain(cost_matrix, reg):
+            return self.sinkhorn_log(dist_1, dist_2, cost_matrix, reg, nit)
+
+        u, K, v = self.sinkhorn_scalings(dist_1, dist_2, cost_matrix, reg, nit)
+        # calculate the transport matrix
+        return (u.unsqueeze(2) * K * v.unsqueeze(1)).cpu()
+
+    def sinkhorn_scalings(
+        self,
+        dist_1: torch.Tensor,
+        dist_2: torch.Tensor,
+        cost_matrix: torch.Tensor,
+        reg: float = 0.1,
+        nit: int = 500,
+    ):
+        """Documentation
+        The sinkhorn iterations returning the scalings of the kernel.
+
+        Args:
+            dist_1: The distribution of the first input.
+            dist_2: The distribution of the second input.
+            cost_matrix: The cost matrix.
+            reg: The regularization factor. Default 0.1.
+            nit: Number of maximum iterations. Default 500.
+
+        Returns:
+            Tuple[torch.Tensor]: The u, K and v tensors; the transport
+                matrix is diag(u) K diag(v).
+
         """
         # asset the dimensions
         assert dist_1.shape[0] == cost_matrix.shape[0]
         assert dist_2.shape[0] == cost_matrix.shape[0]
+
         # prepare the initial variables
         dist_1 = dist_1.to(self.device)
         dist_2 = dist_2.to(self.device)
@@ -108,6 +344,8 @@ class Wasserstein(nn.Module):
         # initialize the u and v tensor
         u = torch.ones_like(dist_1).to(self.device)
         v = torch.ones_like(dist_2).to(self.device)
+        # the padded positions have zero mass
+        is_masked = bool((dist_1 == 0).any())
         istep = 0
         while istep < nit:
             # calculate K.T * u for each example in batch
@@ -116,9 +354,174 @@ class Wasserstein(nn.Module):
             v = dist_2 / KTransposeU
             # calculate the u_{i} tensor
             u = 1.0 / Kp.bmm(v.unsqueeze(2)).squeeze(2)
+            if is_masked:
+                u = torch.where(dist_1 > 0, u, torch.zeros_like(u))
             # go to next step
             istep = istep + 1
+            if self.__should_check(istep):
+                # calculate the marginal error of the second distribution
+                KTransposeU = K.transpose(1, 2).bmm(u.unsqueeze(2)).squeeze(2)
+                if self.__marginal_error(v * KTransposeU, dist_2) < self.tol:
+                    break
+        self.__log_iterations(istep)
+        return u, K, v
+
+    def sinkhorn_log(
+        self,
+        dist_1: torch.Tensor,
+        dist_2: torch.Tensor,
+        cost_matrix: torch.Tensor,
+        reg: float = 0.1,
+        nit: int = 500,
+    ):
+        """Documentation
+        The log-domain (stabilized) sinkhorn algorithm, which does not
+            underflow for small regularization factors.
+
+        Args:
+            dist_1: The distribution of the first input.
+            dist_2: The distribution of the second input.
+            cost_matrix: The cost matrix.
+            reg: The regularization factor. Default 0.1.
+            nit: Number of maximum iterations. Default 500.
+
+        Returns:
+            torch.Tensor: The transportation matrix.
+
+        """
+        log_u, log_K, log_v = self.sinkhorn_log_scalings(
+            dist_1, dist_2, cost_matrix, reg, nit
+        )
         # calculate the transport matrix
-        U = torch.diag_embed(u)
-        V = torch.diag_embed(v)
-        return U.bmm(K).bmm(V).cpu()
+        return torch.exp(log_u.unsqueeze(2) + log_K + log_v.unsqueeze(1)).cpu()
+
+    def sinkhorn_log_scalings(
+        self,
+        dist_1: torch.Tensor,
+        dist_2: torch.Tensor,
+        cost_matrix: torch.Tensor,
+        reg: float = 0.1,
+        nit: int = 500,
+    ):
+        """Documentation
+        The log-domain sinkhorn iterations returning the log scalings.
+
+        Args:
+            dist_1: The distribution of the first input.
+            dist_2: The distribution of the second input.
+            cost_matrix: The cost matrix.
+            reg: The regularization factor. Default 0.1.
+            nit: Number of maximum iterations. Default 500.
+
+        Returns:
+            Tuple[torch.Tensor]: The log u, log K and log v tensors.
+
+        """
+        # prepare the initial variables
+        log_dist_1 = torch.log(dist_1.to(self.device))
+        log_dist_2 = torch.log(dist_2.to(self.device))
+        log_K = (-cost_matrix / reg).to(self.device)
+        # initialize the log u and log v tensors
+        log_u = torch.zeros_like(log_dist_1)
+        log_v = torch.zeros_like(log_dist_2)
+        istep = 0
+        while istep < nit:
+            # calculate the log v_{i} tensor
+            log_v = log_dist_2 - torch.logsumexp(log_K + log_u.unsqueeze(2), dim=1)
+            # calculate the log u_{i} tensor
+            log_u = log_dist_1 - torch.logsumexp(log_K + log_v.unsqueeze(1), dim=2)
+            # go to next step
+            istep = istep + 1
+            if self.__should_check(istep):
+                # calculate the marginal error of the second distribution
+                log_T = log_u.unsqueeze(2) + log_K + log_v.unsqueeze(1)
+                marginal = torch.logsumexp(log_T, dim=1).exp()
+                error = self.__marginal_error(marginal, dist_2.to(self.device))
+                if error < self.tol:
+                    break
+        self.__log_iterations(istep)
+        return log_u, log_K, log_v
+
+    def __use_log_domain(self, cost_matrix: torch.Tensor, reg: float) -> bool:
+        """Checks if the log-domain iterations are used"""
+        if self.log_domain is None:
+            # use the log-domain iterations only when the kernel underflows
+            return cost_matrix.max().item() / reg > MAX_EXP_RATIO
+        return self.log_domain
+
+    def __cost_tiles(self, X: torch.Tensor, Y: torch.Tensor, block_size: int):
+        """Generates the cost matrix tiles of the normalized embeddings"""
+        for i in range(0, X.shape[0], block_size):
+            for j in range(0, Y.shape[0], block_size):
+                rows = slice(i, i + block_size)
+                cols = slice(j, j + block_size)
+                yield rows, cols, 1 - X[rows].matmul(Y[cols].T)
+
+    def __blocked_logsumexp(
+        self,
+        X: torch.Tensor,
+        Y: torch.Tensor,
+        log_scaling: torch.Tensor,
+        block_size: int,
+        dim: int,
+    ) -> torch.Tensor:
+        """Calculates logsumexp(log K + log_scaling) over the given dimension
+
+        The partial reductions of the tiles are combined with logaddexp.
+        """
+        size = Y.shape[0] if dim == 0 else X.shape[0]
+        result = torch.full((size,), float("-inf"), device=X.device)
+        for rows, cols, C in self.__cost_tiles(X, Y, block_size):
+            if dim == 0:
+                tile = -C / self.reg + log_scaling[rows].unsqueeze(1)
+                partial = torch.logsumexp(tile, dim=0)
+                result[cols] = torch.logaddexp(result[cols], partial)
+            else:
+                tile = -C / self.reg + log_scaling[cols].unsqueeze(0)
+                partial = torch.logsumexp(tile, dim=1)
+                result[rows] = torch.logaddexp(result[rows], partial)
+        return result
+
+    def __log_iterations(self, istep: int):
+        """Stores the number of used iterations"""
+        self.n_iter = istep
+        self.total_calls += 1
+        self.total_iter += istep
+
+    def __should_check(self, istep: int) -> bool:
+        """Checks if the marginal error is evaluated in the given step"""
+        return self.tol is not None and istep % self.check_every == 0
+
+    def __marginal_error(self, marginal: torch.Tensor, dist: torch.Tensor) -> float:
+        """Calculates the largest marginal error in the batch"""
+        return torch.linalg.vector_norm(marginal - dist, ord=2, dim=1).max().item()
+
+
+# ===============================================
+# Helper Functions
+# ===============================================
+
+
+def get_size_buckets(
+    sizes: List[int], max_batch: int = 64, max_ratio: float = 2.0
+) -> List[List[int]]:
+    """Groups the sorted input sizes into buckets of similar sizes
+
+    Args:
+        sizes: The input sizes sorted in ascending order.
+        max_batch: The maximum number of inputs in a bucket.
+        max_ratio: The maximum ratio between the largest and smallest
+            input size in a bucket.
+
+    Returns:
+        List[List[int]]: The list of buckets containing the input positions.
+    """
+    buckets, bucket = [], []
+    for idx, size in enumerate(sizes):
+        if bucket and (len(bucket) == max_batch or size > max_ratio * sizes[bucket[0]]):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(idx)
+    if bucket:
+        buckets.append(bucket)
+    return buckets